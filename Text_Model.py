@@ -31,8 +31,224 @@ release 2: July 2008
 
 #By: Nithya Deepak, Priyanka Agarwal, Nisha Bhatia
 
+import os
 import sys
 import math
+import time
+import multiprocessing
+import json
+import re
+import mmap
+import struct
+import zlib
+import pickle
+import hashlib
+import heapq
+from bisect import bisect_left
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from itertools import chain, islice
+
+_numpy = None   # the numpy module once loadNumpy has found it, False if missing
+
+def loadNumpy():
+    """  loadNumpy returns the numpy module, or None when numpy is not
+         installed; numpy is only imported the first time it is needed,
+         everything that uses it falls back to plain Python without it
+    """
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+class StageProfiler:
+
+    def __init__(self, callback=None, allocations=False):
+        """ the constructor for the StageProfiler class
+            a StageProfiler, once enabled (see enableProfiling, or use it in
+            a with statement, which enables again whatever profiler was
+            enabled before it), records every stage of building and comparing
+            TextModels: the stages are clean, tokenize (the single pass
+            that cleans the text and counts words, punctuation and sentence
+            lengths), words, sentencelengths, wordlengths, punctuation,
+            stems, normalize, tables (building the log tables of a scorer),
+            prefilter (the first pass of a CandidateFilter) and compare,
+            and while building a model one stage per feature
+            extractor, named after its feature (see extractText);
+            stages can nest, e.g. makeStems runs words, and their times
+            include the stages inside them
+
+            for each stage it keeps the number of calls, the wall time,
+            the characters of text processed and, with allocations True,
+            the bytes allocated (net, as traced by tracemalloc, which is
+            started while the profiler is enabled if it is not running
+            already, and slows everything down)
+            callback, if given, is called as callback(stage, seconds,
+            chars, allocated) after every stage
+
+            while no profiler is enabled, each instrumented call costs one
+            global lookup and the entering and leaving of a shared no-op
+        """
+        self.callback = callback
+        self.allocations = allocations
+        self.stats = {}   # stage -> [calls, seconds, chars, allocated]
+        self.tracing = False   # True if the profiler started tracemalloc
+        self.previous = None   # the profiler enabled before the with statement
+
+    def __repr__(self):
+        """ this method creates the string version of StageProfiler objects
+        """
+        return "StageProfiler(stages=" + str(list(self.stats)) + ")"
+
+    def __enter__(self):
+        self.previous = _profiler
+        enableProfiling(self)
+        return self
+
+    def __exit__(self, *exc):
+        disableProfiling()
+        if self.previous is not None:
+            enableProfiling(self.previous)
+            self.previous = None
+
+    def start(self):
+        """This method is called by enableProfiling: it starts tracemalloc if needed"""
+        if self.allocations:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.tracing = True
+
+    def stop(self):
+        """This method is called by disableProfiling: it stops tracemalloc if it started it"""
+        if self.tracing:
+            import tracemalloc
+            tracemalloc.stop()
+            self.tracing = False
+
+    def stage(self, name, chars=0):
+        """This method returns the context manager timing one run of the stage name"""
+        return _Stage(self, name, chars)
+
+    def record(self, name, seconds, chars=0, allocated=0):
+        """This method adds one run of the stage name to the statistics"""
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = [0, 0.0, 0, 0]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] += chars
+        stats[3] += allocated
+        if self.callback is not None:
+            self.callback(name, seconds, chars, allocated)
+
+    def metrics(self):
+        """This method returns the statistics as a dictionary mapping each
+        stage to a dictionary of its calls, seconds, chars, allocated bytes
+        (None unless allocations are traced) and characters per second"""
+        metrics = {}
+        for name in self.stats:
+            calls, seconds, chars, allocated = self.stats[name]
+            metrics[name] = {"calls": calls, "seconds": seconds, "chars": chars,
+                             "allocated": allocated if self.allocations else None,
+                             "chars/s": chars / seconds if seconds > 0 else None}
+        return metrics
+
+    def report(self):
+        """This method returns the statistics as a printable table"""
+        lines = ["%-16s %8s %10s %12s %14s" % ("stage", "calls", "seconds", "chars", "allocated")]
+        for name in self.stats:
+            calls, seconds, chars, allocated = self.stats[name]
+            lines.append("%-16s %8d %10.4f %12d %14s" % (name, calls, seconds, chars,
+                         str(allocated) if self.allocations else "-"))
+        return "\n".join(lines)
+
+    def reset(self):
+        """This method forgets all the statistics"""
+        self.stats = {}
+
+    def merge(self, stats):
+        """This method adds stats, the statistics of another profiler (its
+        stats attribute), e.g. one that ran in a worker process"""
+        for name in stats:
+            mine = self.stats.get(name)
+            if mine is None:
+                mine = self.stats[name] = [0, 0.0, 0, 0]
+            for i in range(4):
+                mine[i] += stats[name][i]
+
+class _Stage:
+    """one timed run of a stage of a StageProfiler"""
+
+    __slots__ = ("profiler", "name", "chars", "start", "memory")
+
+    def __init__(self, profiler, name, chars):
+        self.profiler = profiler
+        self.name = name
+        self.chars = chars
+
+    def __enter__(self):
+        if self.profiler.allocations:
+            import tracemalloc
+            self.memory = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        allocated = 0
+        if self.profiler.allocations:
+            import tracemalloc
+            allocated = tracemalloc.get_traced_memory()[0] - self.memory
+        self.profiler.record(self.name, seconds, self.chars, allocated)
+
+class _NoStage:
+    """what profileStage returns while profiling is disabled: does nothing"""
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+_NO_STAGE = _NoStage()
+_profiler = None   # the enabled StageProfiler, None while profiling is disabled
+
+def enableProfiling( profiler=None ):
+    """  enableProfiling starts recording the stages of every TextModel in
+         profiler (a new StageProfiler if None) and returns it
+    """
+    global _profiler
+    if profiler is None:
+        profiler = StageProfiler()
+    if _profiler is not None:
+        _profiler.stop()
+    profiler.start()
+    _profiler = profiler
+    return profiler
+
+def disableProfiling():
+    """  disableProfiling stops recording stages and returns the profiler
+         that was recording them, None if there was none
+    """
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+def profileStage( name, chars=0 ):
+    """  profileStage returns the context manager to run the stage name in:
+         it times the stage if profiling is enabled and does nothing if not
+    """
+    if _profiler is None:
+        return _NO_STAGE
+    return _profiler.stage(name, chars)
 
 class PorterStemmer:
 
@@ -347,6 +563,335 @@ class PorterStemmer:
         return self.b[self.k0:self.k+1]
 
 
+# Suffix tables for FastPorterStemmer, holding the same rules as
+# PorterStemmer.step2, step3 and step4 in the same order. step2 and step4
+# dispatch on the next-to-last letter of the word, step3 on the last one.
+STEP2_SUFFIXES = {
+    'a': (("ational", "ate"), ("tional", "tion")),
+    'c': (("enci", "ence"), ("anci", "ance")),
+    'e': (("izer", "ize"),),
+    'l': (("bli", "ble"), ("alli", "al"), ("entli", "ent"), ("eli", "e"), ("ousli", "ous")),
+    'o': (("ization", "ize"), ("ation", "ate"), ("ator", "ate")),
+    's': (("alism", "al"), ("iveness", "ive"), ("fulness", "ful"), ("ousness", "ous")),
+    't': (("aliti", "al"), ("iviti", "ive"), ("biliti", "ble")),
+    'g': (("logi", "log"),),
+}
+STEP3_SUFFIXES = {
+    'e': (("icate", "ic"), ("ative", ""), ("alize", "al")),
+    'i': (("iciti", "ic"),),
+    'l': (("ical", "ic"), ("ful", "")),
+    's': (("ness", ""),),
+}
+STEP4_SUFFIXES = {
+    'a': ("al",),
+    'c': ("ance", "ence"),
+    'e': ("er",),
+    'i': ("ic",),
+    'l': ("able", "ible"),
+    'n': ("ant", "ement", "ment", "ent"),
+    'o': ("ion", "ou"),
+    's': ("ism",),
+    't': ("ate", "iti"),
+    'u': ("ous",),
+    'v': ("ive",),
+    'z': ("ize",),
+}
+
+class _ConsonantTable(dict):
+    """translation table for consonantMask: vowels map to 'v', 'y' to itself
+    and every other character, letter or not, to 'c'"""
+
+    def __missing__(self, code):
+        self[code] = 'c'
+        return 'c'
+
+_CONSONANT_MASK = _ConsonantTable(str.maketrans("aeiouy", "vvvvvy"))
+
+def consonantMask( w ):
+    """  consonantMask returns a string as long as the lower case word w
+         holding 'c' where w has a consonant and 'v' where it has a vowel,
+         in the sense of PorterStemmer.cons
+    """
+    mask = w.translate(_CONSONANT_MASK)
+    if 'y' not in mask:
+        return mask
+    mask = list(mask)
+    for i in range(len(mask)):
+        if mask[i] == 'y':
+            if i == 0 or mask[i-1] == 'v':
+                mask[i] = 'c'
+            else:
+                mask[i] = 'v'
+    return "".join(mask)
+
+class FastPorterStemmer:
+
+    def __init__(self):
+        """ the constructor for the FastPorterStemmer class
+            FastPorterStemmer gives exactly the stems of PorterStemmer but
+            works on indices into the word: its consonant/vowel mask is
+            computed once per word (and again only when a suffix is
+            replaced), so cons is a lookup, the measure and vowel tests
+            are counts and searches over the mask done in C, suffixes are
+            compared in place through tables keyed on the final letters
+            and the word is only rebuilt when a suffix is replaced
+        """
+        self.w = ""     # the word being stemmed, w[0] ... w[k]
+        self.mask = ""  # consonantMask(w)
+        self.k = 0
+        self.j = 0      # j is a general offset into the word
+
+    def m(self):
+        """m() is the measure of w[0] ... w[j], see PorterStemmer.m;
+        every vowel followed by a consonant closes one vc sequence"""
+        return self.mask.count("vc", 0, self.j + 1)
+
+    def doublec(self, j):
+        """doublec(j) is TRUE <=> j,(j-1) contain a double consonant."""
+        return j >= 1 and self.w[j] == self.w[j-1] and self.mask[j] == 'c'
+
+    def cvc(self, i):
+        """cvc(i) is TRUE <=> i-2,i-1,i has the form consonant - vowel - consonant
+        and the second c is not w, x or y, see PorterStemmer.cvc"""
+        return i >= 2 and self.mask.startswith("cvc", i - 2) and self.w[i] not in "wxy"
+
+    def setto(self, s):
+        """setto(s) sets (j+1),...k to the characters in the string s, readjusting k."""
+        if s:
+            self.w = self.w[:self.j+1] + s
+            self.mask = consonantMask(self.w)
+        self.k = self.j + len(s)
+
+    def r(self, s):
+        """r(s) replaces the suffix ending at j with s if m() > 0."""
+        if self.m() > 0:
+            self.setto(s)
+
+    def step1ab(self):
+        """step1ab() gets rid of plurals and -ed or -ing, see PorterStemmer.step1ab"""
+        w = self.w
+        k = self.k
+        if w[k] == 's':
+            if w.endswith("sses", 0, k + 1):
+                k = k - 2
+            elif w.endswith("ies", 0, k + 1):
+                self.j = k - 3
+                self.setto("i")
+                w = self.w
+                k = self.k
+            elif w[k - 1] != 's':
+                k = k - 1
+            self.k = k
+        last = w[k]
+        if last == 'd':
+            if w.endswith("eed", 0, k + 1):
+                if self.mask.count("vc", 0, k - 2) > 0:
+                    self.k = k - 1
+                return
+            if not w.endswith("ed", 0, k + 1):
+                return
+            j = k - 2
+        elif last == 'g':
+            if not w.endswith("ing", 0, k + 1):
+                return
+            j = k - 3
+        else:
+            return
+        if self.mask.find("v", 0, j + 1) < 0:
+            return
+        self.j = self.k = k = j
+        if w.endswith("at", 0, k + 1):
+            self.j = k - 2
+            self.setto("ate")
+        elif w.endswith("bl", 0, k + 1):
+            self.j = k - 2
+            self.setto("ble")
+        elif w.endswith("iz", 0, k + 1):
+            self.j = k - 2
+            self.setto("ize")
+        elif self.doublec(k):
+            if w[k] not in "lsz":
+                self.k = k - 1
+        elif self.m() == 1 and self.cvc(k):
+            self.setto("e")
+
+    def step1c(self):
+        """step1c() turns terminal y to i when there is another vowel in the stem."""
+        k = self.k
+        if self.w[k] == 'y' and self.mask.find("v", 0, k) >= 0:
+            self.j = k - 1
+            self.setto("i")
+
+    def step2(self):
+        """step2() maps double suffices to single ones, see PorterStemmer.step2"""
+        k = self.k
+        if k < 1:
+            return
+        rules = STEP2_SUFFIXES.get(self.w[k - 1])
+        if rules is None:
+            return
+        for suffix, replacement in rules:
+            if self.w.endswith(suffix, 0, k + 1):
+                self.j = k - len(suffix)
+                self.r(replacement)
+                return
+
+    def step3(self):
+        """step3() deals with -ic-, -full, -ness etc., see PorterStemmer.step3"""
+        k = self.k
+        rules = STEP3_SUFFIXES.get(self.w[k])
+        if rules is None:
+            return
+        for suffix, replacement in rules:
+            if self.w.endswith(suffix, 0, k + 1):
+                self.j = k - len(suffix)
+                self.r(replacement)
+                return
+
+    def step4(self):
+        """step4() takes off -ant, -ence etc., in context <c>vcvc<v>."""
+        k = self.k
+        if k < 1:
+            return
+        suffixes = STEP4_SUFFIXES.get(self.w[k - 1])
+        if suffixes is None:
+            return
+        for suffix in suffixes:
+            if self.w.endswith(suffix, 0, k + 1):
+                j = k - len(suffix)
+                if suffix == "ion" and (j < 0 or self.w[j] not in "st"):
+                    return
+                if self.mask.count("vc", 0, j + 1) > 1:
+                    self.k = j
+                return
+
+    def step5(self):
+        """step5() removes a final -e if m() > 1, and changes -ll to -l if
+        m() > 1.
+        """
+        k = self.k
+        self.j = k
+        w = self.w
+        if w[k] == 'e':
+            a = self.mask.count("vc", 0, k + 1)
+            if a > 1 or (a == 1 and not self.cvc(k - 1)):
+                k = k - 1
+        if w[k] == 'l' and self.doublec(k) and self.mask.count("vc", 0, self.j + 1) > 1:
+            k = k - 1
+        self.k = k
+
+    def stem(self, p, i, j):
+        """stem(p,i,j) stems p[i] ... p[j] exactly like PorterStemmer.stem(p,i,j)"""
+        if j <= i + 1:
+            return p # --DEPARTURE--, as in PorterStemmer.stem
+        if i != 0 or j != len(p) - 1:
+            p = p[i:j+1]
+        self.w = p
+        self.k = len(p) - 1
+        self.j = 0
+        self.mask = consonantMask(p)
+        # each step only runs when the letters it dispatches on allow a rule
+        if p[-1] in "sdg":
+            self.step1ab()
+        if self.w[self.k] == 'y':
+            self.step1c()
+        if self.w[self.k - 1] in STEP2_SUFFIXES:
+            self.step2()
+        if self.w[self.k] in STEP3_SUFFIXES:
+            self.step3()
+        if self.w[self.k - 1] in STEP4_SUFFIXES:
+            self.step4()
+        if self.w[self.k] in "el":
+            self.step5()
+        return self.w[:self.k+1]
+
+def checkStemmer(words, stemmer=None):
+    """  checkStemmer is the conformance check of a stemmer against
+         PorterStemmer: it stems every (lower case) word of words with
+         both and returns a list of (word, expected, got) tuples for
+         the words where they differ, empty when the stemmer conforms
+         stemmer defaults to a FastPorterStemmer
+    """
+    if stemmer is None:
+        stemmer = FastPorterStemmer()
+    reference = PorterStemmer()
+    mismatches = []
+    for w in words:
+        expected = reference.stem(w, 0, len(w) - 1)
+        got = stemmer.stem(w, 0, len(w) - 1)
+        if got != expected:
+            mismatches.append((w, expected, got))
+    return mismatches
+
+class StemCache:
+
+    def __init__(self, maxsize=100000):
+        """ the constructor for the StemCache class
+            a StemCache remembers the stems of the last maxsize distinct
+            words it was asked about, evicting the least recently used
+            word when it is full; all stems come from one
+            FastPorterStemmer, which keeps no state between words
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize should be at least 1, not " + str(maxsize))
+        self.maxsize = maxsize
+        self.stemmer = FastPorterStemmer()
+        self.cache = OrderedDict()   # word -> stem, least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        """ this method creates the string version of StemCache objects
+        """
+        return ("StemCache(size=" + str(len(self.cache)) + ", maxsize=" + str(self.maxsize) +
+                ", hits=" + str(self.hits) + ", misses=" + str(self.misses) + ")")
+
+    def __len__(self):
+        return len(self.cache)
+
+    def stem(self, word):
+        """This method returns the stem of word, which should already be lower case"""
+        cache = self.cache
+        stem = cache.get(word)
+        if stem is not None:
+            self.hits += 1
+            cache.move_to_end(word)
+            return stem
+        self.misses += 1
+        stem = self.stemmer.stem(word, 0, len(word) - 1)
+        cache[word] = stem
+        if len(cache) > self.maxsize:
+            cache.popitem(last=False)
+        return stem
+
+    def stemAll(self, words):
+        """This method stems a whole vocabulary at once: it takes any iterable
+        of lower case words (a dictionary of word counts works) and returns a
+        dictionary mapping each distinct word to its stem"""
+        stems = {}
+        for w in words:
+            if w not in stems:
+                stems[w] = self.stem(w)
+        return stems
+
+    def stats(self):
+        """This method returns the hit/miss statistics of the cache as a dictionary"""
+        lookups = self.hits + self.misses
+        if lookups:
+            hitRate = self.hits / lookups
+        else:
+            hitRate = 0.0
+        return {"hits": self.hits, "misses": self.misses, "hitrate": hitRate,
+                "size": len(self.cache), "maxsize": self.maxsize}
+
+    def clear(self):
+        """This method empties the cache and resets its statistics"""
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+STEM_CACHE = StemCache()   # the cache create_stem and the TextModels share
+
 def create_stem( word ):
     """  This is the primary stemming function:
          create_stem takes in a word, a string,
@@ -354,105 +899,769 @@ def create_stem( word ):
          according to the porter stemmer
 
          the input word should contain no punctuation
+         stems are looked up in STEM_CACHE before being computed
+    """
+    return STEM_CACHE.stem(word.lower())
+
+PUNCTUATION = "!?.:;,'-_()[]{}|"   # characters cleanString removes
+SENTENCE_ENDINGS = "!?."           # characters that end a sentence
+
+UNICODE_DASHES = "\u2010\u2011\u2012\u2013\u2014\u2015\u2212"   # all become "-"
+SINGLE_QUOTES = "\u2018\u2019\u201a\u201b\u2032"                   # all become "'"
+DOUBLE_QUOTES = "\u201c\u201d\u201e\u201f\u2033"                   # all become '"'
+DIGITS = "0123456789"
+
+# words that are followed by a period without ending a sentence
+# (words that also end sentences as they are, such as "no" or "mar", are left out)
+ABBREVIATIONS = frozenset(["mr", "mrs", "ms", "messrs", "dr", "prof", "rev", "hon", "st",
+                           "sr", "jr", "capt", "col", "gen", "lt", "sgt", "gov", "sen",
+                           "mt", "ft", "vs", "cf", "viz", "approx", "vol", "fig", "pp",
+                           "feb", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov"])
+CLOSING_MARKS = "\"')]}\u2019\u201d"   # may follow the punctuation ending a sentence
+OPENING_MARKS = "\"'([{\u2018\u201c"    # may come before the first letter of a word
+_INITIALS = re.compile(r"(?:[^\W\d_]\.)+[^\W\d_]$")   # u.s, e.g: letters between periods
+_WHITESPACE = re.compile(r"\s")
+TOKEN_BLOCK = 1 << 16   # characters of a text split into tokens at a time
+
+def tokenPairs( s, following="", blockSize=TOKEN_BLOCK ):
+    """  tokenPairs yields each whitespace-separated token of s with the
+         token after it (following, the text after s, for the last one);
+         s is split blockSize characters at a time, on whitespace, so
+         only the tokens of one block are ever held
+    """
+    held = []   # the last token of the block before, whose successor comes next
+    start = 0
+    while start < len(s):
+        end = start + blockSize
+        if end >= len(s):
+            end = len(s)
+        else:
+            m = _WHITESPACE.search(s, end)
+            end = m.start() if m else len(s)
+        if start == 0 and end == len(s):
+            tokens = s.split()
+        else:
+            tokens = held + s[start:end].split()
+        start = end
+        if len(tokens) < 2:
+            held = tokens
+            continue
+        held = [tokens.pop()]
+        yield from zip(tokens, chain(islice(tokens, 1, None), held))
+    for token in held:
+        yield token, following
+
+class Cleaner:
+
+    def __init__(self, punctuation=PUNCTUATION, sentenceEndings=SENTENCE_ENDINGS,
+                 foldDashes=False, foldQuotes=False, digits="keep", abbreviations=ABBREVIATIONS):
+        """ the constructor for the Cleaner class
+            a Cleaner holds the character classes used to clean a text
+            and to find its punctuation, compiled once into translation
+            tables so that cleaning a string is a single O(n) pass
+
+            punctuation is the string of characters removed from words
+            and counted as punctuation
+            sentenceEndings is the string of characters that end a sentence
+            foldDashes maps the unicode dashes onto "-"
+            foldQuotes maps curly quotes onto ' and "
+            digits is "keep", "remove" (digits are dropped from words)
+            or "fold" (every digit becomes "0", so numbers count by shape)
+            abbreviations are the words, lower case and without their
+            final period, that do not end a sentence, see endsSentence
+        """
+        if digits not in ("keep", "remove", "fold"):
+            raise ValueError("digits should be 'keep', 'remove' or 'fold', not " + repr(digits))
+        self.punctuation = punctuation
+        self.sentenceEndings = sentenceEndings
+        self.foldDashes = foldDashes
+        self.foldQuotes = foldQuotes
+        self.digits = digits
+
+        normalize = {}
+        if foldDashes:
+            for c in UNICODE_DASHES:
+                normalize[ord(c)] = "-"
+        if foldQuotes:
+            for c in SINGLE_QUOTES:
+                normalize[ord(c)] = "'"
+            for c in DOUBLE_QUOTES:
+                normalize[ord(c)] = '"'
+        if digits == "fold":
+            for c in DIGITS:
+                normalize[ord(c)] = "0"
+        clean = {}
+        for code in normalize:
+            if normalize[code] in punctuation:
+                clean[code] = None
+            else:
+                clean[code] = normalize[code]
+        for c in punctuation:
+            clean[ord(c)] = None
+        if digits == "remove":
+            for c in DIGITS:
+                clean[ord(c)] = None
+        self.normalizeTable = normalize   # maps characters to their normal form
+        self.cleanTable = clean           # normalizes and deletes punctuation
+        self.abbreviations = frozenset(abbreviations)
+        # the sentence endings closing a token, then any closing quotes and brackets
+        self.sentenceEnd = None
+        if sentenceEndings:
+            self.sentenceEnd = re.compile("([" + re.escape(sentenceEndings) + "]+)[" +
+                                          re.escape(CLOSING_MARKS) + "]*$")
+
+    def __repr__(self):
+        """ this method creates the string version of Cleaner objects
+        """
+        return ("Cleaner(punctuation=" + repr(self.punctuation) +
+                ", sentenceEndings=" + repr(self.sentenceEndings) +
+                ", foldDashes=" + str(self.foldDashes) +
+                ", foldQuotes=" + str(self.foldQuotes) +
+                ", digits=" + repr(self.digits) +
+                (", abbreviations=" + str(sorted(self.abbreviations))
+                 if self.abbreviations != ABBREVIATIONS else "") + ")")
+
+    def clean(self, s):
+        """This method returns s lower-cased, normalized and without punctuation"""
+        return s.lower().translate(self.cleanTable)
+
+    def punctuationOf(self, s):
+        """This method returns the punctuation characters of s, in order"""
+        if self.normalizeTable:
+            s = s.translate(self.normalizeTable)
+        return "".join([c for c in s if c in self.punctuation])
+
+    def tokenize(self, s, following=""):
+        """  tokenize is the single pass over a text that every
+             dictionary of a TextModel is built from:
+             it yields one (word, punct, endsSentence) tuple for each
+             whitespace-separated token of s, where
+
+             word is the token cleaned by this Cleaner
+                  (it may be empty, e.g. for a lone dash)
+             punct is a string of the punctuation characters the token held
+             endsSentence is True if the token ends a sentence, see
+                  endsSentence
+
+             following is the text that comes after s, when s is only part
+             of a text, for endsSentence to look at after the last token
+
+             it is a generator, so the tokens can be consumed as they
+             are produced; s is split into tokens a block at a time (see
+             tokenPairs), so a long text is never held as a list of all
+             its tokens
+        """
+        cleanTable = self.cleanTable
+        for token, after in tokenPairs(s, following):
+            word = token.translate(cleanTable)
+            if word == token:
+                yield word.lower(), "", False
+                continue
+            punct = self.punctuationOf(token)
+            endsSentence = False
+            for c in punct:
+                if c in self.sentenceEndings:
+                    endsSentence = self.endsSentence(token, after)
+                    break
+            yield word.lower(), punct, endsSentence
+
+    def endsSentence(self, token, following=""):
+        """This method is True if the whitespace-separated token ends a
+        sentence: it should end with sentence endings, which only closing
+        quotes and brackets may follow, so "3.14" and "u.s.a" do not; of
+        those, an ellipsis ("...", but not "...." or "...?") and a single
+        period after an abbreviation or initials ("Mr.", "e.g.") do not end
+        a sentence either, nor does one after a capital letter other than
+        I when the text following it starts with a capital ("J. Smith")"""
+        if self.normalizeTable:
+            token = token.translate(self.normalizeTable)
+        m = self.sentenceEnd.search(token)
+        if m is None:
+            return False
+        ending = m.group(1)
+        if ending == "...":
+            return False
+        if ending == ".":
+            word = token[:m.start(1)].lstrip(self.punctuation + CLOSING_MARKS + OPENING_MARKS)
+            lower = word.lower()
+            if lower in self.abbreviations or _INITIALS.match(lower):
+                return False
+            if len(word) == 1 and word.isupper() and word != "I":
+                following = following.lstrip().lstrip(OPENING_MARKS)
+                if following[:1].isupper():
+                    return False
+        return True
+
+DEFAULT_CLEANER = Cleaner()
+
+def tokenize( s ):
+    """  tokenize splits s into (word, punct, endsSentence) tuples
+         using the default Cleaner, see Cleaner.tokenize
+    """
+    return DEFAULT_CLEANER.tokenize(s)
+
+def countLengths( words ):
+    """  countLengths takes a dictionary of word counts and returns
+         a dictionary mapping each word length to its number of words
+    """
+    d = {}
+    for w in words:
+        d[len(w)] = d.get(len(w), 0) + words[w]
+    return d
+
+def countStems( words ):
+    """  countStems takes a dictionary of word counts and returns
+         a dictionary mapping each stem to its number of words;
+         every distinct word is stemmed only once, through STEM_CACHE
+    """
+    stems = STEM_CACHE.stemAll(words)
+    d = {}
+    for w in words:
+        stem = stems[w]
+        d[stem] = d.get(stem, 0) + words[w]
+    return d
+
+def countTokens( tokens, n=0, counter=None ):
+    """  countTokens counts a stream of tokens from Cleaner.tokenize
+         and returns (words, punct, sentencelengths, n):
+         the dictionaries of word, punctuation and sentence length counts
+         and the number of words of the last, unfinished sentence;
+         n is that number from an earlier call, so that a sentence
+         can be continued across calls
+         the length of a sentence is its number of words: tokens that
+         are only punctuation do not count, and the sentence endings of
+         a sentence without words, e.g. in "Stop ! !", are not counted
+         if counter is a WordGramCounter, the words are also appended to
+         it in the order they come, for the word n-grams
+    """
+    words = {}
+    punctuation = {}
+    sentencelengths = {}
+    append = None
+    if counter is not None:
+        append = counter.append
+    for word, punct, endsSentence in tokens:
+        if word:
+            n += 1
+            words[word] = words.get(word, 0) + 1
+            if append is not None:
+                append(word)
+        for c in punct:
+            punctuation[c] = punctuation.get(c, 0) + 1
+        if endsSentence and n:
+            sentencelengths[n] = sentencelengths.get(n, 0) + 1
+            n = 0
+    return words, punctuation, sentencelengths, n
+
+def addCounts( d, counts ):
+    """  addCounts adds the dictionary of counts into the dictionary d
+    """
+    for k in counts:
+        d[k] = d.get(k, 0) + counts[k]
+
+class NGrams:
+
+    def __init__(self, charSizes=(3, 4, 5), wordSizes=(2, 3), buckets=1 << 18):
+        """ the constructor for the NGrams class
+            an NGrams counts the character n-grams (of each length in
+            charSizes) and the word n-grams (of each length in wordSizes)
+            of a text into a fixed number of buckets: every n-gram is
+            hashed to one of buckets integer keys, and the count of a key
+            is the count of all n-grams hashed to it, so the dictionaries
+            never have more than buckets keys however large the corpus
+
+            character n-grams are taken inside each word, padded with a
+            space on each side so that its start and end count as well;
+            word n-grams are taken over the words in order, across
+            sentences
+
+            the hash is crc32 of the utf-8 n-gram, the same in every
+            process and every run, so that models built anywhere and
+            saved to disk agree on what each bucket holds
+        """
+        self.charSizes = tuple(charSizes)
+        self.wordSizes = tuple(wordSizes)
+        self.buckets = buckets
+        if buckets < 1:
+            raise ValueError("buckets should be at least 1, not " + str(buckets))
+        for n in self.charSizes + self.wordSizes:
+            if n < 1:
+                raise ValueError("n-gram lengths should be at least 1, not " + str(n))
+        # the last words of a text that can start a word n-gram ending in the next text
+        self.history = max(self.wordSizes, default=1) - 1
+
+    def __repr__(self):
+        """ this method creates the string version of NGrams objects
+        """
+        return ("NGrams(charSizes=" + str(self.charSizes) + ", wordSizes=" +
+                str(self.wordSizes) + ", buckets=" + str(self.buckets) + ")")
+
+    def __eq__(self, other):
+        return isinstance(other, NGrams) and repr(self) == repr(other)
+
+    def __hash__(self):
+        return hash(repr(self))
+
+    def settings(self):
+        """This method returns the arguments the NGrams was made with, as
+        a dictionary of plain data"""
+        return {"charSizes": list(self.charSizes), "wordSizes": list(self.wordSizes),
+                "buckets": self.buckets}
+
+    def charGrams(self, words):
+        """This method takes a dictionary of word counts and returns the
+        hashed counts of their character n-grams; each distinct word is
+        cut into n-grams only once, and each n-gram goes straight into its
+        bucket, so no more than buckets keys are ever held"""
+        buckets = self.buckets
+        crc32 = zlib.crc32
+        d = {}
+        for w in words:
+            n = words[w]
+            padded = (" " + w + " ").encode("utf-8")
+            if len(padded) == len(w) + 2:   # ascii: the bytes are the characters
+                for size in self.charSizes:
+                    for i in range(len(padded) - size + 1):
+                        b = crc32(padded[i:i+size]) % buckets
+                        d[b] = d.get(b, 0) + n
+            else:
+                padded = " " + w + " "
+                for size in self.charSizes:
+                    for i in range(len(padded) - size + 1):
+                        b = crc32(padded[i:i+size].encode("utf-8")) % buckets
+                        d[b] = d.get(b, 0) + n
+        return d
+
+    def wordGramCounter(self, lastWords=()):
+        """This method returns a WordGramCounter that carries on from the
+        list of words lastWords"""
+        return WordGramCounter(self, lastWords)
+
+class WordGramCounter:
+
+    def __init__(self, ngrams, lastWords=()):
+        """ the constructor for the WordGramCounter class
+            a WordGramCounter counts the word n-grams of the NGrams ngrams
+            as the words of a text are appended to it one at a time, each
+            n-gram going straight into its bucket, so that only the last
+            few words are ever held, never the text's sequence of words;
+            lastWords are the words of the text before, which the first
+            n-grams can start in, but which are not counted again
+        """
+        self.sizes = ngrams.wordSizes
+        self.buckets = ngrams.buckets
+        self.window = deque(lastWords, maxlen=max(self.sizes, default=1))
+        self.counts = {}
+
+    def __repr__(self):
+        """ this method creates the string version of WordGramCounter objects
+        """
+        return "WordGramCounter(sizes=" + str(self.sizes) + ", keys=" + str(len(self.counts)) + ")"
+
+    def append(self, word):
+        """This method counts the n-grams that end at word"""
+        window = self.window
+        window.append(word)
+        last = tuple(window)
+        d = self.counts
+        for size in self.sizes:
+            if size <= len(last):
+                b = zlib.crc32(" ".join(last[len(last) - size:]).encode("utf-8")) % self.buckets
+                d[b] = d.get(b, 0) + 1
+
+    def lastWords(self, history):
+        """This method returns the list of the last history words appended"""
+        if history <= 0:
+            return []
+        return list(self.window)[-history:]
+
+# the dictionaries an NGrams counts for a TextModel
+NGRAM_FEATURES = ("chargrams", "wordgrams")
+
+CHUNK_SIZE = 1 << 20   # characters read at a time when streaming a file
+
+def iterChunks( source, chunkSize=CHUNK_SIZE ):
+    """  iterChunks yields the text of source a chunk at a time:
+         source may be a filename, a file object opened in text mode
+         or any iterable of strings (which are yielded as they are);
+         a file opened here is closed once it is read or the
+         generator is closed
+    """
+    if isinstance(source, str):
+        with open(source) as f:
+            yield from iterChunks(f, chunkSize)
+    elif hasattr(source, "read"):
+        while True:
+            chunk = source.read(chunkSize)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        yield from source
+
+class CountDict(dict):
+    """  a CountDict is the dictionary of counts behind each feature of a
+         TextModel: it is an ordinary dict that also keeps a version,
+         which goes up on every change, so that whatever was computed
+         from it can tell when it is out of date
+    """
+    __slots__ = ("version",)
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.version = 0
+
+    def __reduce__(self):
+        return (_restoreCountDict, (dict(self), self.version))
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.version += 1
+
+    def __ior__(self, other):
+        dict.update(self, other)
+        self.version += 1
+        return self
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.version += 1
+
+    def setdefault(self, key, default=None):
+        self.version += 1
+        return dict.setdefault(self, key, default)
+
+    def pop(self, *args):
+        self.version += 1
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.version += 1
+        return dict.popitem(self)
+
+    def clear(self):
+        dict.clear(self)
+        self.version += 1
+
+def _restoreCountDict( d, version ):
+    """  _restoreCountDict rebuilds a pickled CountDict
+    """
+    counts = CountDict(d)
+    counts.version = version
+    return counts
+
+class FeatureView:
+
+    __slots__ = ("counts", "version", "total", "_normalized", "_logs", "_smallest")
+
+    def __init__(self, counts, total=None):
+        """ the constructor for the FeatureView class
+            a FeatureView holds what is derived from one CountDict of a
+            TextModel for comparing it: the total of the counts, and,
+            computed the first time they are asked for, the normalized
+            dictionary, its log-probabilities and its smallest value;
+            it belongs to one version of counts
+            total is the sum of the counts when it is already known
+        """
+        self.counts = counts
+        self.version = counts.version
+        if total is None:
+            total = sum(counts.values())
+        self.total = total
+        self._normalized = None
+        self._logs = None
+        self._smallest = None
+
+    def __repr__(self):
+        """ this method creates the string version of FeatureView objects
+        """
+        return "FeatureView(keys=" + str(len(self.counts)) + ", total=" + str(self.total) + ")"
+
+    def isCurrent(self, counts):
+        """This method is True if the view still describes the dictionary counts"""
+        return counts is self.counts and counts.version == self.version
+
+    def normalized(self):
+        """This method returns the counts normalized to add up to one"""
+        if self._normalized is None:
+            with profileStage("normalize"):
+                total = self.total
+                self._normalized = {k: v / total for k, v in self.counts.items()}
+        return self._normalized
+
+    def logs(self):
+        """This method returns the natural log of every normalized count"""
+        if self._logs is None:
+            normalized = self.normalized()
+            with profileStage("normalize"):
+                log = math.log
+                self._logs = {k: log(v) for k, v in normalized.items()}
+        return self._logs
+
+    def smallest(self):
+        """This method returns the smallest normalized value, None if there are no counts"""
+        if self._smallest is None and self.counts:
+            self._smallest = min(self.counts.values()) / self.total
+        return self._smallest
+
+def _featureProperty( name ):
+    """  _featureProperty makes the property behind a feature dictionary of
+         TextModel, which turns any dictionary assigned to it into a CountDict
     """
-    p = PorterStemmer()
-    word = word.lower() # lowercases word
-    N = len(word)
-    stem = p.stem( word, 0, N-1 )
-    return stem
+    key = "_" + name
+    def get(self):
+        try:
+            return self.__dict__[key]
+        except KeyError:
+            return self.loadFeature(name)
+    def set(self, d):
+        if not isinstance(d, CountDict):
+            d = CountDict(d)
+        self.__dict__[key] = d
+    def delete(self):
+        del self.__dict__[key]
+    return property(get, set, delete, doc="the dictionary of " + name + " counts, a CountDict")
 
 class TextModel:
 
-    def __init__(self, name):
+    words = _featureProperty("words")
+    wordlengths = _featureProperty("wordlengths")
+    stems = _featureProperty("stems")
+    sentencelengths = _featureProperty("sentencelengths")
+    punct = _featureProperty("punct")
+    chargrams = _featureProperty("chargrams")
+    wordgrams = _featureProperty("wordgrams")
+
+
+    def __init__(self, name, cleaner=None, ngrams=None, features=None):
         """ the constructor for the TextModel class
             all dictionaries are started at empty
             the name is just for our own purposes, to keep things 
             organized
+            cleaner is the Cleaner deciding what counts as punctuation,
+            the default one if None
+            ngrams is the NGrams counting the hashed character and word
+            n-grams into chargrams and wordgrams, None to leave them out
+            features lists the names of the dictionaries to build, out of
+            FEATURE_EXTRACTORS: FEATURES, and NGRAM_FEATURES with ngrams,
+            if None; enabling an n-gram feature without ngrams uses a
+            default NGrams
         """
         self.name = name
+        if cleaner is None:
+            cleaner = DEFAULT_CLEANER
+        self.cleaner = cleaner
+        if features is None:
+            features = FEATURES if ngrams is None else FEATURES + NGRAM_FEATURES
+        for feature in features:
+            if feature not in FEATURE_EXTRACTORS:
+                raise ValueError("unknown feature " + repr(feature) + ", see registerFeature")
+        if ngrams is None and any(f in NGRAM_FEATURES for f in features):
+            ngrams = NGrams()
+        self.ngrams = ngrams
+        self.enabled = tuple(features)   # see featureNames
         self.words = {}   # starts empty
         self.wordlengths = {}
         self.stems = {}
         self.sentencelengths = {}
         self.punct = {}
-        # you will want another dictionary for your text feature
+        for feature in self.enabled:
+            setattr(self, feature, {})
+        self.views = {}   # feature name -> FeatureView, see view()
+        self.source = None   # the ModelFile features are loaded from, see loadTextModel
+
+    def __getstate__(self):
+        """ the cached views are left out when a TextModel is pickled,
+            and features not yet loaded from a ModelFile are loaded first
+        """
+        if self.source is not None:
+            for feature in self.source.features:
+                getattr(self, feature)
+        state = self.__dict__.copy()
+        state["views"] = {}
+        state["source"] = None
+        return state
 
     def __repr__(self):
         """ this method creates the string version of TextModel objects
         """
+        labels = {"words": "words", "wordlengths": "word lengths",
+                  "sentencelengths": "sentence lengths", "stems": "stems"}
         s  = "\nModel name: " + str(self.name) + "\n"
-        s += "    n. of words: " + str(len(self.words))  + "\n"
-        s += "    n. of word lengths: " + str(len(self.wordlengths))  + "\n"
-        s += "    n. of sentence lengths: " + str(len(self.sentencelengths))  + "\n"
-        s += "    n. of stems: " + str(len(self.stems))  + "\n"
-        # you will likely want another line for your custom text-feature!
+        for feature in self.enabled:
+            if feature != "punct":
+                s += ("    n. of " + labels.get(feature, FEATURE_LABELS[feature]) + ": " +
+                      str(len(getattr(self, feature)))  + "\n")
         return s
 
     def makeWords(self,s):
         """Makes a dictionary of cleaned words"""
+        with profileStage("words", len(s)):
+            self.words = self.wordCounts(s)
+
+    def wordCounts(self, s):
+        """This method returns the dictionary of cleaned words in s, leaving
+        self.words as it is"""
         dic = {}
-        cleanS = self.cleanString(s)
-        cleanS = cleanS.split()    
-        x = 1
-        for i in cleanS:
-            if i not in dic:
-                dic[i] = 1
-            else:     
-                dic[i] += 1
-        self.words = dic
+        for word, punct, endsSentence in self.cleaner.tokenize(s):
+            if word:
+                dic[word] = dic.get(word, 0) + 1
+        return dic
 
     def cleanString(self,s):
         """This method takes in an input string s and returns it without and 
         punctuation or upper case letters"""
-        s = s.lower()
-        i = 0
-        while (i < len (s)):
-            x= s[i:i+1]
-            #if x in ".,<>&^%$%^%$":
-            if (x == "!" or x == "?" or x == "." or x == ":" or x == ";" or x == "," or x == "'" or x == "-" or x == "_" or x == "(" or x == ")" or x == "[" or x == "]" or x == "{" or x == "}" or x == "|"""):
-                s = s[:i] + s[i+1:]
-            else:
-                i+=1   
-        return s
+        with profileStage("clean", len(s)):
+            return self.cleaner.clean(s)
+
+
+    def featureNames(self):
+        """This function returns the names of the dictionaries the model
+        builds, in the order they are compared"""
+        return self.enabled
+
+    def features(self):
+        """This function returns the dictionaries of the model as a dictionary
+        mapping each feature name to a plain copy of its counts"""
+        return {feature: dict(getattr(self, feature)) for feature in self.featureNames()}
+
+    def addFeatures(self, features, sign=1):
+        """This function adds the counts of features, a dictionary mapping
+        feature names to dictionaries of counts (as extractFeatures returns),
+        into the model; with sign -1 it takes them away instead, dropping
+        keys whose count reaches zero, and raises ValueError without changing
+        anything if that would make a count negative. The total of any
+        cached view is kept up to date rather than summed again"""
+        if sign == -1:
+            for feature in features:
+                counts = getattr(self, feature)
+                part = features[feature]
+                for k in part:
+                    if counts.get(k, 0) < part[k]:
+                        raise ValueError("cannot remove " + str(part[k]) + " of " + repr(k) +
+                                         " from " + feature + ", the model only has " +
+                                         str(counts.get(k, 0)))
+        elif sign != 1:
+            raise ValueError("sign should be 1 or -1, not " + str(sign))
+        for feature in features:
+            counts = getattr(self, feature)
+            part = features[feature]
+            v = self.views.get(feature)
+            current = v is not None and v.isCurrent(counts)
+            added = 0
+            for k in part:
+                n = counts.get(k, 0) + sign * part[k]
+                if n:
+                    counts[k] = n
+                elif k in counts:
+                    del counts[k]
+                added += part[k]
+            if current:
+                self.views[feature] = FeatureView(counts, v.total + sign * added)
 
+    def removeFeatures(self, features):
+        """This function takes the counts of features away from the model,
+        see addFeatures"""
+        self.addFeatures(features, -1)
+
+    def addText(self, s):
+        """This function adds the text s to the dictionaries of the model,
+        keeping what was there, and returns the features of s so that
+        they can be removed again with removeFeatures"""
+        features = extractFeatures([s], self.cleaner, ngrams=self.ngrams, features=self.enabled)
+        self.addFeatures(features)
+        return features
+
+    def removeText(self, s):
+        """This function takes the text s, added earlier, out of the model"""
+        self.removeFeatures(extractFeatures([s], self.cleaner, ngrams=self.ngrams,
+                                            features=self.enabled))
+
+    def merge(self, other):
+        """This function adds the dictionaries of the TextModel other into
+        the model and returns the model; both should use the same cleaning,
+        and other should have every feature the model has"""
+        if repr(self.cleaner) != repr(other.cleaner):
+            raise ValueError("cannot merge TextModels with different cleaners: " +
+                             repr(self.cleaner) + " and " + repr(other.cleaner))
+        if self.ngrams != other.ngrams:
+            raise ValueError("cannot merge TextModels with different n-grams: " +
+                             repr(self.ngrams) + " and " + repr(other.ngrams))
+        missing = [f for f in self.enabled if f not in other.featureNames()]
+        if missing:
+            raise ValueError("cannot merge a TextModel without " + ", ".join(missing))
+        self.addFeatures({f: dict(getattr(other, f)) for f in self.enabled})
+        return self
+
+    def loadFeature(self, feature):
+        """This function loads the dictionary named feature from self.source,
+        the ModelFile of a lazily loaded model, the first time it is used"""
+        if self.source is None or feature not in self.source.features:
+            raise AttributeError("TextModel " + repr(self.name) + " has no dictionary " + repr(feature))
+        setattr(self, feature, self.source.counts(feature))
+        counts = getattr(self, feature)
+        logs = self.source.logs(feature)
+        if logs is not None:
+            v = FeatureView(counts)
+            v._logs = logs
+            self.views[feature] = v
+        return counts
+
+    def saveModel(self, filename):
+        """This function saves the dictionaries of the model, and the
+        log-probabilities of any cached views, to filename, see ModelFile"""
+        saveTextModel(self, filename)
+
+    def compact(self):
+        """This function returns a CompactTextModel holding the same counts,
+        to keep many trained models in memory"""
+        return CompactTextModel.fromModel(self)
 
     def readTextFromFile(self, filename):
         """This functions reads the text from a file and saves it as a string"""
-        f = open(filename)
-        textfromfile = f.read()
+        with open(filename) as f:
+            textfromfile = f.read()
         return str(textfromfile)
 
+    def createAllDictionariesFromFile(self, source, chunkSize=CHUNK_SIZE):
+        """ does what createAllDictionaries does for the whole text of
+            source, a filename, a file object or an iterable of strings,
+            reading it chunkSize characters at a time so that the text
+            is never held in memory at once
+        """
+        for feature in self.enabled:
+            setattr(self, feature, {})
+        builder = TextModelBuilder(self)
+        for chunk in iterChunks(source, chunkSize):
+            builder.feed(chunk)
+        builder.finish()
+
     def printAllDictionaries(self):
         """This function formats and prints all the dictionaries"""
         print("The text model named [ "  + self.name + " ] has dictionaries:")
-        print("self.sentencelengths:", end=" ")
-        print(self.sentencelengths)
-        print("self.words:", end=" ")
-        print(self.words)
-        print("self.wordlengths:", end=" ")
-        print(self.wordlengths)
-        print("self.stems:", end=" ")
-        print(self.stems)
-        print("self.punct:", end=" ")
-        print(self.punct)
+        order = ("sentencelengths", "words", "wordlengths", "stems", "punct")
+        for feature in [f for f in order if f in self.enabled] + [f for f in self.enabled if f not in order]:
+            print("self." + feature + ":", end=" ")
+            print(getattr(self, feature))
 
     def makeSentenceLengths(self,s):
-        """This function creates a dictionary with all the sentence lengths"""
-        d = {}
-        i = 0
-        while i < len(s): 
-            x= s[i:i+1]
-            if (x == "!" or x == "?" or x == "."):
-                str1 = self.countWords(s[:i])
-                s = s[i+2:]
-                i = 0
-                pw = str1
-                if(pw not in d):
-                    d[pw] = 1
-                else:
-                    d[pw] += 1
-            else: i+=1
-        self.sentencelengths = d
+        """This function creates a dictionary with all the sentence lengths,
+        the length of a sentence being its number of words, as countTokens
+        counts them; text after the last sentence ending is not counted"""
+        with profileStage("sentencelengths", len(s)):
+            d = {}
+            n = 0
+            for word, punct, endsSentence in self.cleaner.tokenize(s):
+                if word:
+                    n += 1
+                if endsSentence and n:
+                    d[n] = d.get(n, 0) + 1
+                    n = 0
+            self.sentencelengths = d
 
     def countWords(self, s):
         """This function counts the amount of words in a given string"""
@@ -463,95 +1672,48 @@ class TextModel:
         return i
 
     def makeWordLengths(self,s):
-        """This function creates a dictionary with all the puntuation"""
-        d = {}
-        s = self.cleanString(s)
-        i = 0
-        while i < len(s):
-            x= s[i:i+1]
-            if (x in " \n\r"):
-                str1 = len(s[:i])
-                s = s[i+1:]
-                i = 0
-                pw = str1
-                
-                if(pw not in d):
-                    d[pw] = 1
-                else:
-                    d[pw] += 1
-            elif (x != " " and i+1 == len(s)):
-                str1 = len(s[:i+1])
-                s = s[i+1:]
-                i = 0
-                pw = str1
-                
-                if(pw not in d):
-                    d[pw] = 1
-                else:
-                    d[pw] += 1
-            else:
-                i+=1
-        self.wordlengths = d
+        """This function creates a dictionary with all the word lengths"""
+        with profileStage("wordlengths", len(s)):
+            self.wordlengths = countLengths(self.wordCounts(s))
 
     def makePunctuation(self, s):
         """This function creates a dictionary with all the puntuation"""
-        d = {}
-        i = 0
-        while i < len(s):
-            x= s[i:i+1]
-            if (x == "!" or x == "?" or x == "." or x == ":" or x == ";" or x == "," or x == "'" or x == "-" or x == "_" or x == "(" or x == ")" or x == "[" or x == "]" or x == "{" or x == "}" or x == "|"""):
-                s = s[i+1:]
-                i = 0
-                pw = x
-                if(pw not in d):
-                    d[pw] = 1
-                else:
-                    d[pw] += 1
-            else:
-                i+=1
-        self.punct = d
+        with profileStage("punctuation", len(s)):
+            d = {}
+            for word, punct, endsSentence in self.cleaner.tokenize(s):
+                for c in punct:
+                    d[c] = d.get(c, 0) + 1
+            self.punct = d
     
     def makeStems(self, s):
         """This function creates a dictionary with all the word stems"""
-        cleaned_str = self.cleanString(s)
-        cleaned_str = cleaned_str.split()
-        new_Str = ""
-        for i in cleaned_str:
-            string = str(create_stem(i)) + " "
-            new_Str += string
-        new_Str = new_Str[:-1]
-        i = 0
-        d = {}
-        while i < len(new_Str):
-            if new_Str[i] in "\n\r":
-                string = new_Str[:i]
-                new_Str = new_Str[i+1:]
-                i = 0
-                if string not in d:
-                    d[string] = 1
-                else:
-                    d[string] += 1
-            elif new_Str[i] == " " or i+1 == len(new_Str):
-                string = new_Str[:i+1]
-                new_Str = new_Str[i+1:]
-                i = 0
-                if string not in d:
-                    d[string] = 1
-                else:
-                    d[string] += 1
-            else:
-                i += 1
-        self.stems = d
+        with profileStage("stems", len(s)):
+            self.stems = countStems(self.wordCounts(s))
+
+    def view(self, feature):
+        """This function returns the FeatureView of the dictionary named feature,
+        reusing the cached one unless the dictionary has changed since"""
+        counts = getattr(self, feature)
+        v = self.views.get(feature)
+        if v is None or not v.isCurrent(counts):
+            v = FeatureView(counts)
+            self.views[feature] = v
+        return v
+
+    def normalized(self, feature):
+        """This function returns the cached normalized dictionary named feature"""
+        return self.view(feature).normalized()
 
     def normalizeDictionary(self, d):
         """Should take a dictionary d and normalize it so all the values are out of one"""
-        nd = d.copy()
-        sum = 0
-        for k in d:
-            sum += d[k]
-        for i in d:
-            nd[i] = (d[i])/sum     
-        return nd
+        with profileStage("normalize"):
+            nd = d.copy()
+            sum = 0
+            for k in d:
+                sum += d[k]
+            for i in d:
+                nd[i] = (d[i])/sum     
+            return nd
        
     def smallestValue(self, nd1, nd2):
         """Should take in inputs from normalized dictionary and return the smallest of the values"""
@@ -563,77 +1725,2283 @@ class TextModel:
             return b_min
         return a_min
 
+    def scoreDictionaries(self, d, nd1, nd2):
+        """This function returns the log-probabilities (prob1, prob2) that the
+        counts in d arose from the same source as nd1 and as nd2"""
+        with profileStage("compare"):
+            logEpsilon = math.log(self.smallestValue(nd1,nd2)/2)
+            prob1 = 0
+            prob2 = 0
+            for i in d:
+                if i not in nd1:
+                    prob1 += d[i] * logEpsilon
+                else:
+                    prob1 += d[i] * math.log(nd1[i])
+                if i not in nd2:
+                    prob2 += d[i] * logEpsilon
+                else:
+                    prob2 += d[i] * math.log(nd2[i])
+            return prob1, prob2
+
     def compareDictionaries(self, d, nd1, nd2):
         """This function returns the probability that each dictionary arose from the same source"""
-        epsilon = self.smallestValue(nd1,nd2)/2
-        prob1 = 0
-        prob2 = 0
-        nd1k = nd1.keys()
-        nd2k = nd2.keys()
-        for i in d.keys():
-            if i not in nd1k:
-                prob1 += d[i] *math.log( epsilon )
-            else:
-                prob1 += d[i] *math.log(nd1[i])
-            if i not in nd2k:
-                prob2 += d[i] *math.log( epsilon )
-            else:
-                prob2 += d[i] *math.log(nd2[i])
-        prob1 = '{0:.4g}'.format(prob1)
-        prob2 = '{0:.4g}'.format(prob2)
-        return "[" + str(prob1) + "      " + str(prob2) + "]"
+        return formatScores(self.scoreDictionaries(d, nd1, nd2))
     
     def createAllDictionaries(self, s): 
-        """ should create out all five of self's 
+        """ should create out all of self's enabled
             dictionaries in full - for testing and 
             checking how they are working...
+            all are built from one pass of self.cleaner.tokenize over s,
+            see extractText
         """
-        self.makeSentenceLengths(s)
-        new_s = self.cleanString(s)
-        self.makeWords(new_s)
-        self.makeStems(new_s)
-        self.makePunctuation(s)
-        self.makeWordLengths(new_s)
+        features, n, lastWords = extractText(self, s)
+        for feature in features:
+            setattr(self, feature, features[feature])
     
+    def scoreTextWithTwoModels(self, model1, model2):
+        """This function compares self with two models and returns the result
+        as a Comparison, with every score computed once and nothing printed"""
+        return Comparison.fromScores([model1.name, model2.name],
+                                     ModelScorer([model1, model2]).score(self))
+
     def compareTextWithTwoModels(self, model1, model2):
-        """This function will completely compare three texts with each other"""
-        word1 = self.normalizeDictionary(model1.words)
-        word2 = self.normalizeDictionary(model2.words)
-        wordL1 = self.normalizeDictionary(model1.wordlengths)
-        wordL2 = self.normalizeDictionary(model2.wordlengths)
-        sL1 = self.normalizeDictionary(model1.sentencelengths)
-        sL2 = self.normalizeDictionary(model2.sentencelengths)
-        st1 = self.normalizeDictionary(model1.stems)
-        st2 = self.normalizeDictionary(model2.stems)
-        pun1 = self.normalizeDictionary(model1.punct)
-        pun2 = self.normalizeDictionary(model2.punct)
-        print("                 name           vsTM1        vsTM2")
-        print("                 ----           -----        -----")
-        print("                words          " + self.compareDictionaries(self.words,word1,word2))
-        print("          wordlengths          " + self.compareDictionaries(self.wordlengths,wordL1,wordL2))
-        print("      sentencelenghts          " + self.compareDictionaries(self.sentencelengths,sL1,sL2))
-        print("                stems          " + self.compareDictionaries(self.stems,st1,st2))
-        print("          punctuation          " + self.compareDictionaries(self.punct,pun1,pun2))   
-        countm1 = 0
-        countm2 = 0
-
-        if (float(self.compareDictionaries(self.words,word1,word2).split("      ")[0][1:]) > float(self.compareDictionaries(self.words,word1,word2).split("      ")[1][:-1])):
-            countm1 += 1
-        if (float(self.compareDictionaries(self.wordlengths,wordL1,wordL2).split("      ")[0][1:]) > float(self.compareDictionaries(self.wordlengths,wordL1,wordL2).split("      ")[1][:-1])):
-            countm1 += 1
-        if (float(self.compareDictionaries(self.sentencelengths,sL1,sL2).split("      ")[0][1:]) > float(self.compareDictionaries(self.sentencelengths,sL1,sL2).split("      ")[1][:-1])):
-            countm1 += 1
-        if (float(self.compareDictionaries(self.stems,st1,st2).split("      ")[0][1:]) > float(self.compareDictionaries(self.stems,st1,st2).split("      ")[1][:-1])):
-            countm1 += 1
-        if (float(self.compareDictionaries(self.punct,pun1,pun2).split("      ")[0][1:]) > float(self.compareDictionaries(self.punct,pun1,pun2).split("      ")[1][:-1])):
-            countm1 += 1
-        countm2 = 5 - countm1
-        print("-->  Model1 wins on " + str(countm1) + " features.")
-        print("-->  Model2 wins on " + str(countm2) + " features.")
-        print("\n")
-        if countm1 > countm2:
-            print("+++++        Model1 is the better match!         +++++")
-        else:
-            print("+++++        Model2 is the better match!         +++++")
+        """This function will completely compare three texts with each other,
+        print the table of scores and return the Comparison it printed"""
+        result = self.scoreTextWithTwoModels(model1, model2)
+        print(result.render())
+        return result
+
+class TextModelBuilder:
+
+    def __init__(self, model):
+        """ the constructor for the TextModelBuilder class
+            a TextModelBuilder adds text to the dictionaries of model
+            one chunk at a time: a word cut by the end of a chunk is
+            held back until the next chunk completes it, and a sentence
+            keeps counting its words across chunks
+        """
+        self.model = model
+        self.carry = ""       # the start of a token cut by the end of the last chunk
+        self.sentenceWords = 0   # words of the sentence still going on
+        self.lastWords = []      # the words word n-grams may carry on from
+        self.finished = False
+
+    def feed(self, chunk):
+        """This method adds the text of chunk to the dictionaries of the model"""
+        if self.finished:
+            raise ValueError("this TextModelBuilder is already finished")
+        text = self.carry + chunk
+        # the last token is held back even when it is whole, as whether the
+        # token before it ends a sentence may depend on it
+        stripped = text.rstrip()
+        parts = stripped.rsplit(None, 1)
+        if len(parts) < 2:
+            self.carry = text
+            return
+        self.carry = parts[1] + text[len(stripped):]
+        self.add(parts[0], self.carry)
+
+    def finish(self):
+        """This method adds the text still held back and returns the model;
+        a last sentence without a sentence ending is not counted"""
+        if not self.finished:
+            self.add(self.carry)
+            self.carry = ""
+            self.finished = True
+        return self.model
 
+    def add(self, text, following=""):
+        """This method counts text, which ends on a token boundary, into the
+        model; following is the start of the text after it"""
+        features, self.sentenceWords, self.lastWords = \
+            extractText(self.model, text, self.sentenceWords, self.lastWords, following)
+        self.model.addFeatures(features)
+
+# the five features of a TextModel, in the order they are compared and printed
+FEATURES = ("words", "wordlengths", "sentencelengths", "stems", "punct")
+
+# what the single pass of Cleaner.tokenize over a text gives the extractors
+TOKEN_INPUTS = ("words", "punct", "sentencelengths", "wordgramcounts")
+
+class FeatureExtractor:
+
+    def __init__(self, name, compute, needs=("words",), weight=1, label=None, version=1):
+        """ the constructor for the FeatureExtractor class
+            a FeatureExtractor says how one dictionary of a TextModel is
+            built: name is the feature, the attribute of the model that
+            holds its counts, and compute(model, inputs) returns the
+            dictionary of counts of a text, where inputs maps each of
+            needs to what was found in the text:
+                text             the text itself
+                words            the dictionary of word counts
+                punct            the dictionary of punctuation counts
+                sentencelengths  the dictionary of sentence length counts
+                wordgramcounts   the hashed counts of the word n-grams of
+                                 the model's NGrams, counted as the words
+                                 come
+            the tokenize pass runs once for all the extractors a model
+            enables, and only if one of them needs one of TOKEN_INPUTS
+            weight is what winning this feature counts in a Comparison
+            label is the feature's row label in a printed Comparison
+            version should change whenever compute changes what it counts,
+            so that no FeatureCache returns counts made the old way
+        """
+        self.name = name
+        self.compute = compute
+        self.needs = tuple(needs)
+        self.weight = weight
+        if label is None:
+            label = name
+        self.label = label
+        self.version = version
+
+    def __repr__(self):
+        """ this method creates the string version of FeatureExtractor objects
+        """
+        return ("FeatureExtractor(" + repr(self.name) + ", needs=" + str(self.needs) +
+                ", weight=" + str(self.weight) + ")")
+
+FEATURE_EXTRACTORS = {}   # feature name -> FeatureExtractor, see registerFeature
+
+# the attributes of TextModel and CompactTextModel objects, which no feature can be named
+MODEL_ATTRIBUTES = frozenset(["name", "cleaner", "ngrams", "enabled", "views", "source", "counts"])
+
+# the row label of each feature in a printed Comparison
+FEATURE_LABELS = {}
+
+def registerFeature( extractor ):
+    """  registerFeature adds extractor, a FeatureExtractor, to the features
+         a TextModel can build, replacing any extractor of the same name;
+         models then get the feature when it is listed in their features
+         (worker processes started by spawn rather than fork only know
+         the features registered when Text_Model is imported)
+    """
+    name = extractor.name
+    if name in MODEL_ATTRIBUTES or name.startswith("_"):
+        raise ValueError("a feature cannot be named " + repr(name) +
+                         ", the name is kept for the attributes of TextModel objects")
+    current = getattr(TextModel, name, None)
+    if current is None:
+        setattr(TextModel, name, _featureProperty(name))
+    elif not isinstance(current, property):
+        raise ValueError("a feature cannot be named " + repr(name) + ", TextModel has a method of that name")
+    FEATURE_EXTRACTORS[name] = extractor
+    FEATURE_LABELS[name] = extractor.label
+
+def _inputWords( model, inputs ):
+    return inputs["words"]
+
+def _inputPunctuation( model, inputs ):
+    return inputs["punct"]
+
+def _inputSentenceLengths( model, inputs ):
+    return inputs["sentencelengths"]
+
+def _wordLengths( model, inputs ):
+    return countLengths(inputs["words"])
+
+def _stems( model, inputs ):
+    return countStems(inputs["words"])
+
+def _charGrams( model, inputs ):
+    return model.ngrams.charGrams(inputs["words"])
+
+def _wordGrams( model, inputs ):
+    return inputs["wordgramcounts"]
+
+registerFeature(FeatureExtractor("words", _inputWords))
+registerFeature(FeatureExtractor("wordlengths", _wordLengths))
+registerFeature(FeatureExtractor("sentencelengths", _inputSentenceLengths, ("sentencelengths",)))
+registerFeature(FeatureExtractor("stems", _stems))
+registerFeature(FeatureExtractor("punct", _inputPunctuation, ("punct",), label="punctuation"))
+registerFeature(FeatureExtractor("chargrams", _charGrams, label="char n-grams"))
+registerFeature(FeatureExtractor("wordgrams", _wordGrams, ("wordgramcounts",), label="word n-grams"))
+
+def featureWeight( feature ):
+    """  featureWeight returns the weight of the registered feature, 1 for
+         a feature nothing is registered for
+    """
+    extractor = FEATURE_EXTRACTORS.get(feature)
+    if extractor is None:
+        return 1
+    return extractor.weight
+
+def extractText( model, text, sentenceWords=0, lastWords=(), following="" ):
+    """  extractText builds the enabled dictionaries of model for text
+         without changing the model, and returns (features, sentenceWords,
+         lastWords): the dictionary mapping each feature to its counts,
+         and what to pass for text that carries on from this one: the
+         words of the unfinished last sentence and the last words, that
+         word n-grams can carry on from; following is the start of the
+         text after this one, see Cleaner.tokenize
+         each extractor is one profiled stage, named after its feature
+    """
+    extractors = [FEATURE_EXTRACTORS[f] for f in model.featureNames()]
+    needs = set()
+    for extractor in extractors:
+        needs.update(extractor.needs)
+    inputs = {"text": text}
+    if needs.intersection(TOKEN_INPUTS):
+        counter = None
+        if "wordgramcounts" in needs:
+            counter = model.ngrams.wordGramCounter(lastWords)
+        with profileStage("tokenize", len(text)):
+            words, punctuation, sentencelengths, sentenceWords = \
+                countTokens(model.cleaner.tokenize(text, following), sentenceWords, counter)
+        inputs["words"] = words
+        inputs["punct"] = punctuation
+        inputs["sentencelengths"] = sentencelengths
+        if counter is not None:
+            inputs["wordgramcounts"] = counter.counts
+            lastWords = counter.lastWords(model.ngrams.history)
+    features = {}
+    for extractor in extractors:
+        with profileStage(extractor.name):
+            features[extractor.name] = extractor.compute(model, inputs)
+    return features, sentenceWords, lastWords
+
+# goes up whenever the built-in cleaning and counting change what they
+# count, so that a FeatureCache never returns counts made the old way
+EXTRACTION_VERSION = 2
+
+def extractionConfig( model ):
+    """  extractionConfig returns the string describing how model extracts
+         features: EXTRACTION_VERSION, its Cleaner and NGrams, and the name
+         and version of each of its features
+    """
+    parts = [str(EXTRACTION_VERSION), repr(model.cleaner), repr(model.ngrams)]
+    for feature in model.featureNames():
+        parts.append(feature + "=" + str(FEATURE_EXTRACTORS[feature].version))
+    return "|".join(parts)
+
+def extractFeatures( source, cleaner=None, chunkSize=CHUNK_SIZE, ngrams=None, features=None,
+                     cache=None ):
+    """  extractFeatures builds the dictionaries of one document, source
+         being a filename, a file object or an iterable of strings, and
+         returns them as a dictionary mapping each feature name to a plain
+         dictionary of counts, which is cheap to send between processes;
+         ngrams and features are those of the TextModel to build
+         cache is a FeatureCache the features are looked up in first, and
+         kept in after they are extracted, when source is a filename or a
+         list of strings
+    """
+    model = TextModel(None, cleaner, ngrams, features)
+    key = None
+    if cache is not None:
+        key = cache.key(source, extractionConfig(model))
+        if key is not None:
+            found = cache.get(key)
+            if found is not None:
+                return found
+    model.createAllDictionariesFromFile(source, chunkSize)
+    result = model.features()
+    if key is not None:
+        cache.put(key, result)
+    return result
+
+class FeatureCache:
+
+    def __init__(self, directory, maxBytes=1 << 30):
+        """ the constructor for the FeatureCache class
+            a FeatureCache keeps the features extracted from documents in
+            directory, one file per document, so that a document whose
+            text and extraction config have not changed is not extracted
+            again: an entry is found by the sha256 of the config (see
+            extractionConfig) and the content of the document
+
+            any number of processes may use the same directory at once: an
+            entry is written to a temporary file and renamed into place, so
+            it is either complete or missing, and an entry that cannot be
+            read counts as a miss; reading an entry touches it, and once
+            the entries take more than maxBytes the least recently used
+            ones are deleted until they take 90% of it
+
+            entries are pickles, so only use a directory nobody else writes
+        """
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.written = None   # bytes written since the size was last checked, None before
+
+    def __repr__(self):
+        """ this method creates the string version of FeatureCache objects
+        """
+        return ("FeatureCache(" + repr(self.directory) + ", maxBytes=" + str(self.maxBytes) +
+                ", hits=" + str(self.hits) + ", misses=" + str(self.misses) + ")")
+
+    def __getstate__(self):
+        """ a FeatureCache sent to a worker process starts its own statistics
+            and its own count of the bytes written, see _startWorker
+        """
+        return {"directory": self.directory, "maxBytes": self.maxBytes,
+                "hits": 0, "misses": 0, "written": None}
+
+    def key(self, source, config):
+        """This method returns the key of the document source, a filename or
+        a list of strings, extracted as config says, or None for any other
+        source, which cannot be read twice"""
+        h = hashlib.sha256(config.encode("utf-8"))
+        h.update(b"\0")
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                while True:
+                    block = f.read(CHUNK_SIZE)
+                    if not block:
+                        break
+                    h.update(block)
+        elif isinstance(source, (list, tuple)):
+            for chunk in source:
+                h.update(chunk.encode("utf-8"))
+        else:
+            return None
+        return h.hexdigest()
+
+    def path(self, key):
+        """This method returns the file of the entry key"""
+        return os.path.join(self.directory, key[:2], key[2:] + ".features")
+
+    def get(self, key):
+        """This method returns the features kept under key, None if there
+        are none"""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                features = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return features
+
+    def put(self, key, features):
+        """This method keeps features under key, replacing any entry there"""
+        import tempfile
+        path = self.path(key)
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as f:
+                pickle.dump(features, f, pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise
+        if self.written is None or self.written + size > self.maxBytes // 10:
+            self.evict()
+            self.written = 0
+        else:
+            self.written += size
+
+    def entries(self):
+        """This method returns the list of (last use, bytes, file) of every
+        entry; temporary files more than an hour old, left by a process
+        that died while writing, are deleted"""
+        entries = []
+        stale = time.time() - 3600
+        for folder, subfolders, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(folder, name)
+                try:
+                    st = os.stat(path)
+                    if name.endswith(".tmp"):
+                        if st.st_mtime < stale:
+                            os.remove(path)
+                        continue
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """This method deletes the least recently used entries while they take
+        more than maxBytes, down to 90% of it, and returns how many it deleted"""
+        entries = self.entries()
+        total = sum(size for used, size, path in entries)
+        if total <= self.maxBytes:
+            return 0
+        entries.sort()
+        deleted = 0
+        for used, size, path in entries:
+            if total <= self.maxBytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                deleted += 1
+            except OSError:   # another process deleted it first
+                pass
+            total -= size
+        return deleted
+
+    def stats(self):
+        """This method returns the hits and misses of this process, and the
+        number and bytes of the entries"""
+        entries = self.entries()
+        return {"hits": self.hits, "misses": self.misses, "entries": len(entries),
+                "bytes": sum(size for used, size, path in entries), "maxBytes": self.maxBytes}
+
+    def clear(self):
+        """This method deletes every entry"""
+        for used, size, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def mergeFeatures( total, part ):
+    """  mergeFeatures adds the counts of part, a dictionary of features as
+         returned by extractFeatures, into total and returns total;
+         merging is just adding counts, so partial results can be merged
+         in any order and any grouping with the same result
+    """
+    for feature in part:
+        if feature not in total:
+            total[feature] = {}
+        addCounts(total[feature], part[feature])
+    return total
+
+_workerCache = None   # the FeatureCache of a worker process, see _startWorker
+
+def _startWorker( cache ):
+    """  _startWorker starts each worker process of trainModels, attributeAll
+         and crossValidate: the FeatureCache cache is sent to a worker once
+         and used for all its tasks, so that it counts what the worker
+         writes and only checks the size of the cache now and then
+    """
+    global _workerCache
+    _workerCache = cache
+
+def _extractionPool( processes, cache ):
+    """  _extractionPool returns a pool of processes whose workers extract
+         features with the FeatureCache cache (which may be None)
+    """
+    return multiprocessing.Pool(processes, _startWorker, (cache,))
+
+def _extractTask( task ):
+    """  _extractTask runs extractFeatures in a worker process of trainModels;
+         without a cache of its own the task uses the worker's
+    """
+    name, filename, cleaner, chunkSize, ngrams, features, cache = task
+    if cache is None:
+        cache = _workerCache
+    return name, extractFeatures(filename, cleaner, chunkSize, ngrams, features, cache)
+
+def _timedExtractTask( task ):
+    """  _timedExtractTask runs _extractTask in a worker process of
+         attributeAll and also returns the seconds it took
+    """
+    start = time.perf_counter()
+    name, features = _extractTask(task)
+    return name, features, time.perf_counter() - start
+
+def trainModels( corpus, processes=None, cleaner=None, chunkSize=CHUNK_SIZE, ngrams=None,
+                 features=None, cache=None ):
+    """  trainModels builds one TextModel per author of corpus, a dictionary
+         mapping each author name to a list of filenames: the files are
+         shared out over a pool of processes (as many as there are CPUs
+         if processes is None), each worker extracts the features of one
+         file at a time and the results are merged into the author's
+         model as they arrive; with processes 1 no pool is started
+         ngrams and features are passed on to each TextModel, and cache,
+         a FeatureCache, to extractFeatures
+         returns a dictionary mapping each author name to its TextModel
+    """
+    files = [(name, filename) for name in corpus for filename in corpus[name]]
+    inProcess = processes == 1 or len(files) <= 1
+    # the workers of a pool get the cache once, see _startWorker
+    tasks = [(name, filename, cleaner, chunkSize, ngrams, features, cache if inProcess else None)
+             for name, filename in files]
+    totals = {name: {} for name in corpus}
+    if inProcess:
+        for task in tasks:
+            name, part = _extractTask(task)
+            mergeFeatures(totals[name], part)
+    else:
+        with _extractionPool(processes, cache) as pool:
+            for name, part in pool.imap_unordered(_extractTask, tasks):
+                mergeFeatures(totals[name], part)
+    models = {}
+    for name in corpus:
+        model = TextModel(name, cleaner, ngrams, features)
+        for feature in totals[name]:
+            setattr(model, feature, totals[name][feature])
+        models[name] = model
+    return models
+
+class SparseTable:
+
+    def __init__(self, rows, vocabulary, np):
+        """ the constructor for the SparseTable class
+            a SparseTable holds, with numpy (np), the values of a list of
+            dictionaries, rows, keyed by the keys of vocabulary (which maps
+            each to its column): only the values the rows have are kept,
+            column by column (compressed sparse columns), so its size is
+            that of the rows, not rows x vocabulary, and looking up the
+            columns of an unknown text visits only the rows that have them
+        """
+        self.numpy = np
+        self.nrows = len(rows)
+        self.ncolumns = len(vocabulary)
+        lengths = np.fromiter([len(row) for row in rows], dtype=np.intp, count=len(rows))
+        columns = np.empty(int(lengths.sum()), dtype=np.intp)
+        values = np.empty(len(columns))
+        at = 0
+        for row in rows:
+            n = len(row)
+            columns[at:at + n] = np.fromiter([vocabulary[k] for k in row], dtype=np.intp, count=n)
+            values[at:at + n] = np.fromiter(row.values(), dtype=float, count=n)
+            at += n
+        order = np.argsort(columns, kind="stable")
+        self.rows = np.repeat(np.arange(len(rows), dtype=np.int32), lengths)[order]
+        self.values = values[order]
+        # the entries of column c are self.rows[starts[c]:starts[c + 1]] and their values
+        self.starts = np.zeros(self.ncolumns + 1, dtype=np.intp)
+        np.cumsum(np.bincount(columns, minlength=self.ncolumns), out=self.starts[1:])
+
+    def __repr__(self):
+        """ this method creates the string version of SparseTable objects
+        """
+        return ("SparseTable(rows=" + str(self.nrows) + ", columns=" + str(self.ncolumns) +
+                ", entries=" + str(len(self.values)) + ")")
+
+    def nbytes(self):
+        """This method returns the bytes the table takes"""
+        return self.rows.nbytes + self.values.nbytes + self.starts.nbytes
+
+    def gather(self, columns):
+        """This method takes an array of columns and returns the arrays
+        (entries, rows, values) of every value the table holds in them:
+        the index in columns of its column, its row and the value"""
+        np = self.numpy
+        starts = self.starts[columns]
+        lengths = self.starts[columns + 1] - starts
+        entries = np.repeat(np.arange(len(columns)), lengths)
+        index = np.arange(int(lengths.sum())) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return entries, self.rows[index], self.values[index]
+
+class FeatureScorer:
+
+    def __init__(self, normalized, useNumpy=True, logs=None, smallest=None):
+        """ the constructor for the FeatureScorer class
+            a FeatureScorer holds the normalized dictionaries of one feature
+            for several models and scores a dictionary of counts against all
+            of them at once, exactly as compareDictionaries does for two:
+            the score against a model is the sum over the keys of count *
+            log(probability), where a key the model has never seen gets
+            probability epsilon, half the smallest probability of any model
+
+            the keys of all models are interned into one shared vocabulary;
+            with numpy the log-probabilities of each model, less its
+            unseen log-probability, are kept in a SparseTable and a
+            dictionary is scored by gathering the entries of its keys,
+            without numpy (or with useNumpy False) each model keeps a
+            dictionary of log-probabilities instead
+
+            logs may give the log-probabilities of the normalized
+            dictionaries, already computed, in the same order, and smallest
+            the smallest probability of any of them
+        """
+        self.vocabulary = {}   # feature key -> column of the log table
+        known = smallest is not None
+        for nd in normalized:
+            for k in nd:
+                if k not in self.vocabulary:
+                    self.vocabulary[k] = len(self.vocabulary)
+            if nd and not known:
+                m = min(nd.values())
+                if smallest is None or m < smallest:
+                    smallest = m
+        if smallest is None:   # no model has any counts: every key scores the same
+            smallest = 1.0
+        self.epsilon = smallest / 2
+        self.logEpsilon = math.log(self.epsilon)
+        self.nmodels = len(normalized)
+        self.unseenLogs = [self.logEpsilon] * self.nmodels   # the score of an unseen key, per model
+        self.buildTable(normalized, useNumpy, logs)
+
+    @classmethod
+    def fromViews(cls, views, useNumpy=True):
+        """This method returns the scorer of the FeatureViews of one
+        feature of several models, reusing their cached log-probabilities
+        and smallest values"""
+        smallest = [v.smallest() for v in views]
+        smallest = min([m for m in smallest if m is not None], default=None)
+        return cls([v.normalized() for v in views], useNumpy, [v.logs() for v in views], smallest)
+
+    def buildTable(self, normalized, useNumpy, logs):
+        """This method builds the table of log-probabilities, one row per
+        model, with self.vocabulary and self.unseenLogs already set"""
+        np = None
+        if useNumpy:
+            np = loadNumpy()
+        self.numpy = np
+        if np is not None:
+            if logs is None:
+                logs = [{k: math.log(nd[k]) for k in nd} for nd in normalized]
+            table = SparseTable(logs, self.vocabulary, np)
+            # a key the model lacks scores its unseen log, so the table holds the difference
+            self.unseenArray = np.array(self.unseenLogs, dtype=float)
+            table.values -= self.unseenArray[table.rows]
+            self.table = table
+        elif logs is not None:
+            self.table = list(logs)
+        else:
+            self.table = [{k: math.log(nd[k]) for k in nd} for nd in normalized]
+
+    def __repr__(self):
+        """ this method creates the string version of FeatureScorer objects
+        """
+        return ("FeatureScorer(models=" + str(self.nmodels) + ", vocabulary=" +
+                str(len(self.vocabulary)) + ", numpy=" + str(self.numpy is not None) + ")")
+
+    def score(self, d, rows=None):
+        """This method returns the list of the scores of the dictionary of
+        counts d against every model, in the order the models were given,
+        or only against the models of the list of indices rows"""
+        if rows is None:
+            rows = range(self.nmodels)
+        if self.numpy is not None:
+            scores = self.scoreMany([d])[0]
+            return [scores[i] for i in rows]
+        scores = []
+        for i in rows:
+            logs = self.table[i]
+            logUnseen = self.unseenLogs[i]
+            total = 0
+            for k in d:
+                total += d[k] * logs.get(k, logUnseen)
+            scores.append(total)
+        return scores
+
+    def scoreMany(self, dicts):
+        """This method scores a list of dictionaries of counts at once and
+        returns the list of their score lists; with numpy the entries of
+        the keys of all of them are gathered from the table at once"""
+        if self.numpy is None:
+            return [self.score(d) for d in dicts]
+        np = self.numpy
+        vocabulary = self.vocabulary
+        columns = []
+        counts = []
+        documents = []
+        totals = np.zeros(len(dicts))
+        for i in range(len(dicts)):
+            d = dicts[i]
+            for k in d:
+                column = vocabulary.get(k)
+                if column is not None:
+                    columns.append(column)
+                    counts.append(d[k])
+            documents.extend([i] * (len(columns) - len(documents)))
+            totals[i] = sum(d.values())
+        entries, rows, values = self.table.gather(np.array(columns, dtype=np.intp))
+        documents = np.array(documents, dtype=np.intp)[entries]
+        scores = np.bincount(documents * self.nmodels + rows,
+                             weights=values * np.array(counts, dtype=float)[entries],
+                             minlength=len(dicts) * self.nmodels).reshape(len(dicts), self.nmodels)
+        return (scores + totals.reshape(-1, 1) * self.unseenArray).tolist()
+
+class SmoothedScorer(FeatureScorer):
+
+    def __init__(self, counts, totals, useNumpy=True, alpha=0.5):
+        """ the constructor for the SmoothedScorer class
+            a SmoothedScorer scores like a FeatureScorer, by log-likelihood,
+            but with each model's probabilities smoothed by adding alpha to
+            every count (Lidstone smoothing): over the shared vocabulary V
+            of all models plus one slot for every unseen key, a model with
+            N counts gives key k probability (count + alpha) / (N + alpha *
+            (len(V) + 1)), so the probabilities of every model add up to 1
+            and an unseen key costs each model according to its own size
+            rather than a fraction of the rarest key of any model
+            counts and totals are the dictionaries of counts of the models
+            and their sums
+        """
+        self.vocabulary = {}
+        for c in counts:
+            for k in c:
+                if k not in self.vocabulary:
+                    self.vocabulary[k] = len(self.vocabulary)
+        self.alpha = alpha
+        self.nmodels = len(counts)
+        size = alpha * (len(self.vocabulary) + 1)
+        self.unseenLogs = [math.log(alpha / (totals[i] + size)) for i in range(self.nmodels)]
+        self.epsilon = None
+        self.logEpsilon = None
+        logs = []
+        for i in range(self.nmodels):
+            logTotal = math.log(totals[i] + size)
+            logs.append({k: math.log(c + alpha) - logTotal for k, c in counts[i].items()})
+        self.buildTable(counts, useNumpy, logs)
+
+    @classmethod
+    def fromViews(cls, views, useNumpy=True):
+        """This method returns the scorer of the FeatureViews of one
+        feature of several models"""
+        return cls([v.counts for v in views], [v.total for v in views], useNumpy)
+
+    def __repr__(self):
+        """ this method creates the string version of SmoothedScorer objects
+        """
+        return ("SmoothedScorer(models=" + str(self.nmodels) + ", vocabulary=" +
+                str(len(self.vocabulary)) + ", alpha=" + str(self.alpha) + ")")
+
+class VectorScorer:
+
+    def __init__(self, normalized, useNumpy=True):
+        """ the constructor for the VectorScorer class
+            a VectorScorer is the base of the scorers that compare the
+            normalized dictionary of an unknown text with those of several
+            models as sparse vectors: like a FeatureScorer it interns the
+            keys of the models into one vocabulary and keeps, with numpy, a
+            SparseTable of their probabilities, or else one dictionary per
+            model; scoring a dictionary only visits its keys
+        """
+        self.vocabulary = {}
+        for nd in normalized:
+            for k in nd:
+                if k not in self.vocabulary:
+                    self.vocabulary[k] = len(self.vocabulary)
+        self.nmodels = len(normalized)
+        np = None
+        if useNumpy:
+            np = loadNumpy()
+        self.numpy = np
+        if np is not None:
+            self.table = SparseTable(normalized, self.vocabulary, np)
+        else:
+            self.table = list(normalized)
+
+    @classmethod
+    def fromViews(cls, views, useNumpy=True):
+        """This method returns the scorer of the FeatureViews of one
+        feature of several models"""
+        return cls([v.normalized() for v in views], useNumpy)
+
+    def __repr__(self):
+        """ this method creates the string version of the scorer
+        """
+        return (type(self).__name__ + "(models=" + str(self.nmodels) + ", vocabulary=" +
+                str(len(self.vocabulary)) + ", numpy=" + str(self.numpy is not None) + ")")
+
+    def gather(self, d):
+        """This method returns the arrays (rows, values, modelValues) with
+        one entry for each key of d and each model that has it: the row of
+        the model, the value of the key in d and its value in the model"""
+        np = self.numpy
+        vocabulary = self.vocabulary
+        columns = []
+        values = []
+        for k in d:
+            column = vocabulary.get(k)
+            if column is not None:
+                columns.append(column)
+                values.append(d[k])
+        entries, rows, modelValues = self.table.gather(np.array(columns, dtype=np.intp))
+        return rows, np.array(values, dtype=float)[entries], modelValues
+
+    def scoreMany(self, dicts):
+        """This method returns the list of the score lists of dicts"""
+        return [self.score(d) for d in dicts]
+
+class CosineScorer(VectorScorer):
+    """  a CosineScorer scores a dictionary of counts against each model by
+         the cosine of the angle between their vectors, from 0 (no key in
+         common) to 1 (the same proportions); see VectorScorer
+    """
+
+    def __init__(self, normalized, useNumpy=True):
+        VectorScorer.__init__(self, normalized, useNumpy)
+        self.norms = [math.sqrt(sum(v * v for v in nd.values())) for nd in normalized]
+
+    def score(self, d, rows=None):
+        """This method returns the list of the cosines of the dictionary of
+        counts d with every model, or with the models of the list of
+        indices rows"""
+        if rows is None:
+            rows = range(self.nmodels)
+        norm = math.sqrt(sum(v * v for v in d.values()))
+        if self.numpy is not None:
+            entries, values, modelValues = self.gather(d)
+            dots = self.numpy.bincount(entries, weights=values * modelValues, minlength=self.nmodels)
+            dots = [float(dots[i]) for i in rows]
+        else:
+            dots = []
+            for i in rows:
+                nd = self.table[i]
+                dots.append(sum(d[k] * nd[k] for k in d if k in nd))
+        scores = []
+        for j in range(len(rows)):
+            scale = norm * self.norms[rows[j]]
+            scores.append(dots[j] / scale if scale else 0.0)
+        return scores
+
+class JensenShannonScorer(VectorScorer):
+    """  a JensenShannonScorer scores a dictionary of counts against each
+         model by minus the Jensen-Shannon divergence of their normalized
+         dictionaries, in nats: 0 for the same distribution, down to
+         -log(2) for distributions with no key in common; see VectorScorer
+
+         the divergence sums over the keys of both distributions, but a
+         key only one of them has always adds half its probability times
+         log(2), so only the keys both have are visited, from the
+         divergence log(2) of distributions with no key in common
+    """
+
+    def score(self, d, rows=None):
+        """This method returns the list of minus the Jensen-Shannon
+        divergences of the dictionary of counts d from every model, or from
+        the models of the list of indices rows"""
+        if rows is None:
+            rows = range(self.nmodels)
+        total = sum(d.values())
+        if not total:
+            return [0.0] * len(rows)
+        p = {k: d[k] / total for k in d}
+        half = 0.5 * math.log(2)
+        if self.numpy is not None:
+            np = self.numpy
+            entries, pv, q = self.gather(p)
+            m = pv + q
+            with np.errstate(divide="ignore", invalid="ignore"):
+                terms = 0.5 * np.where(pv > 0, pv * np.log(2 * pv / m), 0.0) + 0.5 * q * np.log(2 * q / m)
+            # each shared key replaces the half*pk and half*qk it would add unshared
+            shared = np.bincount(entries, weights=terms - half * pv - half * q, minlength=self.nmodels)
+            return [-(2 * half + float(shared[i])) for i in rows]
+        scores = []
+        for i in rows:
+            nd = self.table[i]
+            divergence = 0
+            shared = 0
+            for k in p:
+                pk = p[k]
+                qk = nd.get(k, 0)
+                if qk:
+                    m = pk + qk
+                    divergence += 0.5 * pk * math.log(2 * pk / m) + 0.5 * qk * math.log(2 * qk / m)
+                    shared += qk
+                else:
+                    divergence += half * pk
+            scores.append(-(divergence + half * (1 - shared)))
+        return scores
+
+# the ways a ModelScorer can score a feature, see ModelScorer
+SCORERS = {"likelihood": FeatureScorer, "smoothed": SmoothedScorer,
+           "cosine": CosineScorer, "jensenshannon": JensenShannonScorer}
+
+class CandidateFilter:
+
+    def __init__(self, models, feature="words", top=200, useNumpy=True):
+        """ the constructor for the CandidateFilter class
+            a CandidateFilter is the cheap first pass before scoring an
+            unknown text against many models: it keeps only the top most
+            frequent keys of feature of each model and picks the models
+            whose cosine with the unknown text, over those keys, is
+            highest, so that only they need to be scored in full
+        """
+        self.feature = feature
+        self.top = top
+        profiles = []
+        for model in models:
+            counts = getattr(model, feature)
+            keys = heapq.nlargest(top, counts, key=counts.get)
+            total = sum(counts[k] for k in keys)
+            profiles.append({k: counts[k] / total for k in keys})
+        self.scorer = CosineScorer(profiles, useNumpy)
+
+    def __repr__(self):
+        """ this method creates the string version of CandidateFilter objects
+        """
+        return ("CandidateFilter(models=" + str(self.scorer.nmodels) + ", feature=" +
+                repr(self.feature) + ", top=" + str(self.top) + ")")
+
+    def candidates(self, unknown, n):
+        """This method returns the sorted list of the indices of the n
+        models most like unknown, a TextModel or a dictionary of features"""
+        with profileStage("prefilter"):
+            scores = self.scorer.score(featureCounts(unknown, self.feature))
+            if n >= len(scores):
+                return list(range(len(scores)))
+            return sorted(sorted(range(len(scores)), key=lambda i: -scores[i])[:n])
+
+# the features an InvertedIndex looks up by default
+INDEX_FEATURES = ("words", "stems")
+
+class InvertedIndex:
+
+    def __init__(self, models=(), features=INDEX_FEATURES, terms=100, maxShare=0.5):
+        """ the constructor for the InvertedIndex class
+            an InvertedIndex maps every key of the given features of many
+            models to its posting list: the indices of the models that have
+            the key (in the order they were added) and their counts of it
+            so that an unknown text can find the models that share its
+            rare keys without looking at any other model
+
+            of the keys of an unknown text, only the terms rarest ones (in
+            the fewest models) of each feature are looked up, and keys in
+            more than maxShare of the models are never used, as they are
+            too common to tell authors apart
+        """
+        self.features = tuple(features)
+        self.terms = terms
+        self.maxShare = maxShare
+        self.postings = {f: {} for f in self.features}   # feature -> key -> (models, counts)
+        self.totals = {f: array("d") for f in self.features}   # feature -> count total of each model
+        self.nmodels = 0
+        for model in models:
+            self.add(model)
+
+    def __repr__(self):
+        """ this method creates the string version of InvertedIndex objects
+        """
+        return ("InvertedIndex(models=" + str(self.nmodels) + ", features=" + str(list(self.features)) +
+                ", keys=" + str(sum(len(self.postings[f]) for f in self.features)) + ")")
+
+    def add(self, model):
+        """This method adds the keys of model to the posting lists and
+        returns the index of the model"""
+        i = self.nmodels
+        for feature in self.features:
+            counts = getattr(model, feature)
+            postings = self.postings[feature]
+            total = 0
+            for k, n in counts.items():
+                posting = postings.get(k)
+                if posting is None:
+                    posting = postings[k] = (array("I"), array("q"))
+                posting[0].append(i)
+                posting[1].append(n)
+                total += n
+            self.totals[feature].append(total)
+        self.nmodels += 1
+        return i
+
+    def retrieve(self, unknown):
+        """This method returns a dictionary mapping the index of every
+        model that shares one of the rare keys of unknown, a TextModel or
+        a dictionary of features, to its score: over those keys, the
+        count of the key in unknown times its idf, log(models / models
+        with the key), times its frequency in the model"""
+        scores = {}
+        limit = self.maxShare * self.nmodels
+        for feature in self.features:
+            d = featureCounts(unknown, feature)
+            postings = self.postings[feature]
+            totals = self.totals[feature]
+            found = []
+            for k in d:
+                posting = postings.get(k)
+                if posting is not None and len(posting[0]) <= limit:
+                    found.append((len(posting[0]), k, posting))
+            for df, k, (models, counts) in heapq.nsmallest(self.terms, found):
+                weight = d[k] * math.log(self.nmodels / df)
+                for j in range(len(models)):
+                    i = models[j]
+                    scores[i] = scores.get(i, 0.0) + weight * counts[j] / totals[i]
+        return scores
+
+    def candidates(self, unknown, n):
+        """This method returns the sorted list of the indices of the n
+        models that best share the rare keys of unknown; when no model
+        shares any of them, every model is a candidate"""
+        with profileStage("prefilter"):
+            scores = self.retrieve(unknown)
+            if not scores:
+                return list(range(self.nmodels))
+            return sorted(heapq.nlargest(n, scores, key=scores.get))
+
+def featureCounts( unknown, feature ):
+    """  featureCounts returns the dictionary named feature of unknown,
+         which may be a TextModel or a dictionary of features as
+         extractFeatures returns
+    """
+    if isinstance(unknown, dict):
+        return unknown[feature]
+    return getattr(unknown, feature)
+
+class ModelScorer:
+
+    def __init__(self, models, features=None, useNumpy=True, method="likelihood"):
+        """ the constructor for the ModelScorer class
+            a ModelScorer keeps a FeatureScorer for each feature of a list of
+            trained TextModels, built from their cached FeatureViews, so
+            that any number of unknown texts can be scored against them;
+            features defaults to the featureNames of the first model
+            method names the scorer in SCORERS used for every feature:
+            likelihood (compareDictionaries' score, the default), smoothed,
+            cosine or jensenshannon; higher scores are better for all of them
+        """
+        if method not in SCORERS:
+            raise ValueError("unknown scoring method " + repr(method) + ", use one of " +
+                             ", ".join(SCORERS))
+        self.models = list(models)
+        if features is None:
+            features = self.models[0].featureNames() if self.models else FEATURES
+        self.features = tuple(features)
+        self.method = method
+        self.scorers = {}
+        for feature in self.features:
+            views = [m.view(feature) for m in self.models]
+            with profileStage("tables"):
+                self.scorers[feature] = SCORERS[method].fromViews(views, useNumpy)
+
+    def __repr__(self):
+        """ this method creates the string version of ModelScorer objects
+        """
+        return ("ModelScorer(models=" + str([m.name for m in self.models]) +
+                ", features=" + str(list(self.features)) + ", method=" + repr(self.method) + ")")
+
+    def score(self, unknown, rows=None):
+        """This method scores unknown, a TextModel or a dictionary of features,
+        against every model, or only the models of the list of indices rows,
+        and returns a dictionary mapping each feature to the list of scores"""
+        with profileStage("compare"):
+            scores = {}
+            for feature in self.features:
+                scores[feature] = self.scorers[feature].score(featureCounts(unknown, feature), rows)
+            return scores
+
+    def scoreMany(self, unknowns):
+        """This method scores a list of unknowns at once, see score, and
+        returns the list of their dictionaries of scores"""
+        with profileStage("compare"):
+            results = [{} for unknown in unknowns]
+            for feature in self.features:
+                rows = self.scorers[feature].scoreMany([featureCounts(u, feature) for u in unknowns])
+                for i in range(len(unknowns)):
+                    results[i][feature] = rows[i]
+            return results
+
+def formatScores( scores ):
+    """  formatScores returns the scores as the bracketed row printed
+         in a comparison table, e.g. [-9795      -9783]
+    """
+    return "[" + "      ".join(['{0:.4g}'.format(x) for x in scores]) + "]"
+
+class Comparison:
+
+    def __init__(self, names, scores, wins, winner):
+        """ the constructor for the Comparison class
+            a Comparison is the plain numeric result of comparing an
+            unknown text with some models:
+            names is the list of model names
+            scores maps each feature to the list of log-likelihoods of
+            the unknown text under each model
+            wins is the list of how many features each model won
+            winner is the index of the model that won the most features
+        """
+        self.names = names
+        self.scores = scores
+        self.wins = wins
+        self.winner = winner
+
+    @classmethod
+    def fromScores(cls, names, scores, weights=None):
+        """This method decides the winners from a dictionary of scores;
+        winning a feature counts its weight, from weights, a dictionary
+        mapping features to weights, or from its FeatureExtractor if None;
+        on a tie, of a feature or of the whole comparison, the later model
+        wins, as it always has in compareTextWithTwoModels"""
+        wins = [0] * len(names)
+        for feature in scores:
+            row = scores[feature]
+            best = 0
+            for i in range(1, len(row)):
+                if row[i] >= row[best]:
+                    best = i
+            if weights is None:
+                wins[best] += featureWeight(feature)
+            else:
+                wins[best] += weights.get(feature, 1)
+        winner = 0
+        for i in range(1, len(wins)):
+            if wins[i] >= wins[winner]:
+                winner = i
+        return cls(names, scores, wins, winner)
+
+    def __repr__(self):
+        """ this method creates the string version of Comparison objects
+        """
+        return ("Comparison(winner=" + repr(self.names[self.winner]) +
+                ", wins=" + str(self.wins) + ")")
+
+    def totals(self):
+        """This method returns the list of each model's scores summed over all features"""
+        totals = [0.0] * len(self.names)
+        for feature in self.scores:
+            row = self.scores[feature]
+            for i in range(len(row)):
+                totals[i] += row[i]
+        return totals
+
+    def rank(self, k=None):
+        """This method returns the k best models (all of them if k is None)
+        as a list of (name, votes, total) tuples, best first: models are
+        ranked by the number of features they won, then by total score"""
+        totals = self.totals()
+        order = sorted(range(len(self.names)), key=lambda i: (-self.wins[i], -totals[i]))
+        if k is not None:
+            order = order[:k]
+        return [(self.names[i], self.wins[i], totals[i]) for i in order]
+
+    def asDict(self):
+        """This method returns the comparison as a dictionary of plain data"""
+        return {"names": list(self.names),
+                "scores": {f: list(self.scores[f]) for f in self.scores},
+                "wins": list(self.wins),
+                "winner": self.names[self.winner]}
+
+    def render(self):
+        """This method returns the comparison as the table
+        compareTextWithTwoModels prints"""
+        n = len(self.names)
+        lines = ["                 name   " + "".join(["        vsTM" + str(i+1) for i in range(n)]),
+                 "                 ----   " + "".join(["        -----" for i in range(n)])]
+        for feature in self.scores:
+            lines.append(FEATURE_LABELS.get(feature, feature).rjust(21) + "          " +
+                         formatScores(self.scores[feature]))
+        for i in range(n):
+            lines.append("-->  Model" + str(i+1) + " wins on " + str(self.wins[i]) + " features.")
+        lines.append("\n")
+        lines.append("+++++        Model" + str(self.winner+1) + " is the better match!         +++++")
+        return "\n".join(lines)
+
+class AuthorRegistry:
+
+    def __init__(self, models=(), features=None, useNumpy=True, method="likelihood",
+                 prefilter=None, prefilterTop=200, retrieval="cosine"):
+        """ the constructor for the AuthorRegistry class
+            an AuthorRegistry holds the trained TextModels of many candidate
+            authors, by name, and identifies the author of an unknown text
+            among all of them; the models are normalized and their log
+            tables built once, when the registry is first queried after
+            a change, and shared by every query after that
+            features defaults to the featureNames of the models, and method
+            is the scoring method, see ModelScorer
+            queries may ask for only the best candidates of a first pass to
+            be scored, see compare: with retrieval "cosine" the first pass is
+            a CandidateFilter on the prefilterTop most frequent keys of the
+            prefilter feature (by default the words, if the models are
+            scored on them, else the first feature they are scored on),
+            with retrieval "index" it is an InvertedIndex
+            of the INDEX_FEATURES the models are scored on (or of all their
+            features, if none of them is), which only visits the models
+            sharing the rare keys of the unknown text
+        """
+        if retrieval not in ("cosine", "index"):
+            raise ValueError("retrieval should be 'cosine' or 'index', not " + repr(retrieval))
+        self.retrieval = retrieval
+        self.features = features
+        self.useNumpy = useNumpy
+        self.method = method
+        self.prefilter = prefilter
+        self.prefilterTop = prefilterTop
+        self.models = {}      # name -> TextModel
+        self.scorer = None    # the ModelScorer of the models, None when stale
+        self.filter = None    # the CandidateFilter of the models, None when stale
+        for model in models:
+            self.add(model)
+
+    def __repr__(self):
+        """ this method creates the string version of AuthorRegistry objects
+        """
+        return "AuthorRegistry(" + str(list(self.models)) + ")"
+
+    def __len__(self):
+        return len(self.models)
+
+    def __contains__(self, name):
+        return name in self.models
+
+    def __getitem__(self, name):
+        return self.models[name]
+
+    def names(self):
+        """This method returns the list of the registered model names"""
+        return list(self.models)
+
+    def add(self, model):
+        """This method registers model under its name, replacing any model
+        already registered with that name"""
+        self.models[model.name] = model
+        self.scorer = None
+        self.filter = None
+
+    def remove(self, name):
+        """This method removes the model registered under name"""
+        del self.models[name]
+        self.scorer = None
+        self.filter = None
+
+    def getScorer(self):
+        """This method returns the ModelScorer of all registered models,
+        building it if a model was added or removed since the last query"""
+        if self.scorer is None:
+            if not self.models:
+                raise ValueError("the registry has no models to compare with")
+            self.scorer = ModelScorer(self.models.values(), self.features, self.useNumpy, self.method)
+        return self.scorer
+
+    def getFilter(self):
+        """This method returns the first pass, a CandidateFilter or an
+        InvertedIndex, of all registered models, building it if a model
+        was added or removed since it was built"""
+        if self.filter is None:
+            models = self.getScorer().models
+            features = self.getScorer().features
+            if self.retrieval == "index":
+                indexed = [f for f in INDEX_FEATURES if f in features] or features
+                self.filter = InvertedIndex(models, indexed)
+            else:
+                prefilter = self.prefilter
+                if prefilter is None:
+                    prefilter = "words" if "words" in features else features[0]
+                elif prefilter not in features:
+                    raise ValueError("the prefilter feature " + repr(prefilter) +
+                                     " is not one the models are scored on: " + ", ".join(features))
+                self.filter = CandidateFilter(models, prefilter, self.prefilterTop, self.useNumpy)
+        return self.filter
+
+    def compare(self, unknown, candidates=None):
+        """This method compares the TextModel unknown with every registered
+        model and returns the Comparison; with candidates, a number, only
+        that many models, the best of the first pass (see getFilter), are
+        scored in full and in the Comparison"""
+        scorer = self.getScorer()
+        if candidates is None or candidates >= len(scorer.models):
+            return Comparison.fromScores([m.name for m in scorer.models], scorer.score(unknown))
+        rows = self.getFilter().candidates(unknown, candidates)
+        return Comparison.fromScores([scorer.models[i].name for i in rows], scorer.score(unknown, rows))
+
+    def rank(self, unknown, k=10, candidates=None):
+        """This method returns the k most likely authors of the TextModel
+        unknown as a list of (name, votes, total) tuples, best first,
+        where votes is the number of features the author won; candidates
+        is as for compare"""
+        return self.compare(unknown, candidates).rank(k)
+
+    def identify(self, unknown, candidates=None):
+        """This method returns the name of the most likely author of unknown"""
+        return self.rank(unknown, 1, candidates)[0][0]
+
+# A saved TextModel (see saveTextModel) is laid out as
+#
+#   header     magic b"TXTMODEL", format version, reserved
+#   strings    the offsets (uint32, one more than there are strings) and
+#              the utf-8 bytes of every distinct string key of every
+#              feature, so words and stems share their common keys
+#   features   for each feature, its keys (uint32 ids into the strings, or
+#              int64 for features keyed by numbers such as word lengths),
+#              its counts (int64) and, if its view was cached when saved,
+#              its log-probabilities (float64)
+#   directory  JSON with the model name, its Cleaner and NGrams and where each
+#              array is
+#   trailer    offset and length of the directory
+#
+# All numbers are little-endian and every array starts on an 8 byte boundary,
+# so a ModelFile can mmap the file and decode only the features it is asked for.
+MODEL_MAGIC = b"TXTMODEL"
+MODEL_FORMAT_VERSION = 1
+_MODEL_HEADER = struct.Struct("<8sH6x")
+_MODEL_TRAILER = struct.Struct("<QQ")
+
+def _packed( a ):
+    """  _packed returns the bytes of the array a in little-endian order
+    """
+    if sys.byteorder == "big":
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+def _unpacked( typecode, data ):
+    """  _unpacked returns the array of typecode stored little-endian in data
+    """
+    a = array(typecode)
+    a.frombytes(data)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a
+
+def saveTextModel( model, filename ):
+    """  saveTextModel writes the dictionaries of model to filename in the
+         binary format described above; the log-probabilities of every
+         feature whose view is cached and current are written too
+    """
+    if isinstance(model, CompactTextModel):
+        features = list(model.featureNames())
+    else:
+        features = [f for f in model.featureNames() if "_" + f in model.__dict__ or model.source is not None]
+    strings = {}   # string key -> id
+    columns = []   # (feature, keyKind, keys array, counts array, logs array or None)
+    for feature in features:
+        counts = getattr(model, feature)
+        if all(isinstance(k, str) for k in counts):
+            kind = "str"
+            keys = array("I")
+            for k in counts:
+                if k not in strings:
+                    strings[k] = len(strings)
+                keys.append(strings[k])
+        elif all(isinstance(k, int) for k in counts):
+            kind = "int"
+            keys = array("q", counts.keys())
+        else:
+            raise TypeError("the keys of " + feature + " should be all strings or all integers")
+        logs = None
+        v = model.views.get(feature)
+        if v is not None and v.isCurrent(counts) and v._logs is not None:
+            logs = array("d", [v._logs[k] for k in counts])
+        columns.append((feature, kind, keys, array("q", counts.values()), logs))
+
+    encoded = [k.encode("utf-8") for k in strings]
+    offsets = array("I", [0])
+    for b in encoded:
+        offsets.append(offsets[-1] + len(b))
+
+    with open(filename, "wb") as f:
+        def write(data):
+            position = f.tell()
+            f.write(data)
+            f.write(b"\0" * (-f.tell() % 8))
+            return position
+        write(_MODEL_HEADER.pack(MODEL_MAGIC, MODEL_FORMAT_VERSION))
+        directory = {"name": model.name, "strings": len(encoded),
+                     "stringOffsets": write(_packed(offsets)),
+                     "stringData": write(b"".join(encoded)),
+                     "cleaner": {"punctuation": model.cleaner.punctuation,
+                                 "sentenceEndings": model.cleaner.sentenceEndings,
+                                 "foldDashes": model.cleaner.foldDashes,
+                                 "foldQuotes": model.cleaner.foldQuotes,
+                                 "digits": model.cleaner.digits,
+                                 "abbreviations": sorted(model.cleaner.abbreviations)},
+                     "ngrams": None,
+                     "features": []}
+        if model.ngrams is not None:
+            directory["ngrams"] = model.ngrams.settings()
+        for feature, kind, keys, counts, logs in columns:
+            entry = {"name": feature, "keys": kind, "n": len(counts),
+                     "keyData": write(_packed(keys)),
+                     "countData": write(_packed(counts)),
+                     "logData": None}
+            if logs is not None:
+                entry["logData"] = write(_packed(logs))
+            directory["features"].append(entry)
+        data = json.dumps(directory).encode("utf-8")
+        position = f.tell()
+        f.write(data)
+        f.write(_MODEL_TRAILER.pack(position, len(data)))
+
+class ModelFile:
+
+    def __init__(self, filename):
+        """ the constructor for the ModelFile class
+            a ModelFile maps a model saved by saveTextModel into memory and
+            reads only its directory; the keys, counts and log-probabilities
+            of a feature are decoded when that feature is asked for
+        """
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < _MODEL_HEADER.size + _MODEL_TRAILER.size:
+            self.close()
+            raise ValueError(filename + " is not a saved TextModel")
+        magic, version = _MODEL_HEADER.unpack_from(self.map, 0)
+        if magic != MODEL_MAGIC:
+            self.close()
+            raise ValueError(filename + " is not a saved TextModel")
+        if version != MODEL_FORMAT_VERSION:
+            self.close()
+            raise ValueError(filename + " has model format version " + str(version) +
+                             ", only version " + str(MODEL_FORMAT_VERSION) + " can be read")
+        position, length = _MODEL_TRAILER.unpack_from(self.map, len(self.map) - _MODEL_TRAILER.size)
+        directory = json.loads(self.map[position:position+length].decode("utf-8"))
+        self.name = directory["name"]
+        self.cleanerSettings = directory["cleaner"]
+        self.ngramSettings = directory.get("ngrams")
+        self.nstrings = directory["strings"]
+        self.stringOffsets = directory["stringOffsets"]
+        self.stringData = directory["stringData"]
+        self.directory = {}   # feature name -> its directory entry
+        for entry in directory["features"]:
+            self.directory[entry["name"]] = entry
+        self.features = list(self.directory)
+
+    def __repr__(self):
+        """ this method creates the string version of ModelFile objects
+        """
+        return "ModelFile(" + repr(self.filename) + ", name=" + repr(self.name) + ")"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """This method unmaps the file"""
+        self.map.close()
+
+    def array(self, typecode, position, n):
+        """This method returns the n numbers of typecode stored at position"""
+        size = array(typecode).itemsize
+        return _unpacked(typecode, self.map[position:position + n*size])
+
+    def keys(self, feature):
+        """This method returns the list of keys of feature, in saved order"""
+        entry = self.directory[feature]
+        if entry["keys"] == "int":
+            return list(self.array("q", entry["keyData"], entry["n"]))
+        ids = self.array("I", entry["keyData"], entry["n"])
+        offsets = self.array("I", self.stringOffsets, self.nstrings + 1)
+        base = self.stringData
+        data = self.map
+        return [data[base + offsets[i]:base + offsets[i+1]].decode("utf-8") for i in ids]
+
+    def countArray(self, feature):
+        """This method returns the counts of feature as an int64 array"""
+        entry = self.directory[feature]
+        return self.array("q", entry["countData"], entry["n"])
+
+    def counts(self, feature):
+        """This method returns the dictionary of counts of feature"""
+        return dict(zip(self.keys(feature), self.countArray(feature)))
+
+    def compactCounts(self, feature, vocabulary=None):
+        """This method returns the counts of feature as CompactCounts"""
+        return CompactCounts.fromItems(self.keys(feature), self.countArray(feature), vocabulary)
+
+    def logs(self, feature):
+        """This method returns the dictionary of saved log-probabilities of
+        feature, None if they were not saved"""
+        entry = self.directory[feature]
+        if entry["logData"] is None:
+            return None
+        return dict(zip(self.keys(feature), self.array("d", entry["logData"], entry["n"])))
+
+    def cleaner(self):
+        """This method returns the Cleaner the model was built with"""
+        cleaner = Cleaner(**self.cleanerSettings)
+        if repr(cleaner) == repr(DEFAULT_CLEANER):
+            return DEFAULT_CLEANER
+        return cleaner
+
+    def ngrams(self):
+        """This method returns the NGrams the model was built with, None if
+        it counts no n-grams"""
+        if self.ngramSettings is None:
+            return None
+        return NGrams(**self.ngramSettings)
+
+def loadTextModel( filename, lazy=False, compact=False ):
+    """  loadTextModel returns the TextModel saved in filename;
+         with lazy True the file stays mapped and each dictionary is
+         only decoded the first time it is used; with compact True it
+         returns a CompactTextModel instead, and lazy is ignored
+    """
+    source = ModelFile(filename)
+    if compact:
+        with source:
+            counts = {f: source.compactCounts(f) for f in source.features}
+            return CompactTextModel(source.name, counts, source.cleaner(), source.ngrams())
+    model = TextModel(source.name, source.cleaner(), source.ngrams(), source.features)
+    model.source = source
+    for feature in source.features:
+        delattr(model, feature)
+    if not lazy:
+        for feature in source.features:
+            getattr(model, feature)
+        model.source = None
+        source.close()
+    return model
+
+class Vocabulary:
+    """  a Vocabulary interns the string keys of CompactCounts: every
+         distinct string is kept once, however many models and features
+         use it, and stands for an integer id, its position in strings
+    """
+    __slots__ = ("ids", "strings")
+
+    def __init__(self):
+        self.ids = {}       # string -> id
+        self.strings = []   # id -> string
+
+    def __repr__(self):
+        """ this method creates the string version of Vocabulary objects
+        """
+        return "Vocabulary(" + str(len(self.strings)) + " strings)"
+
+    def __len__(self):
+        return len(self.strings)
+
+    def intern(self, s):
+        """This method returns the id of the string s, giving it one if it
+        has none yet"""
+        i = self.ids.get(s)
+        if i is None:
+            s = sys.intern(s)
+            i = len(self.strings)
+            self.ids[s] = i
+            self.strings.append(s)
+        return i
+
+# the Vocabulary shared by every CompactCounts of the process
+VOCABULARY = Vocabulary()
+
+class CompactCounts(Mapping):
+    """  a CompactCounts is a read-only dictionary of counts kept in two
+         typed arrays: the keys, sorted (the ids of string keys in a
+         Vocabulary, or the integer keys themselves), and the counts; a
+         key is found by binary search, and a key and its count take 12
+         or 16 bytes instead of a dict entry and two Python objects
+
+         it can stand in for the CountDict of a feature anywhere the
+         counts are only read: like a dict it can be iterated, indexed,
+         compared and printed, and it never changes, so its version
+         is always 0
+    """
+    __slots__ = ("kind", "keyArray", "countArray", "vocabulary")
+
+    version = 0
+
+    def __init__(self, kind, keyArray, countArray, vocabulary=None):
+        if vocabulary is None:
+            vocabulary = VOCABULARY
+        self.kind = kind               # "str" or "int"
+        self.keyArray = keyArray       # array of I (ids) or q (integers), sorted
+        self.countArray = countArray   # array of q, in the order of keyArray
+        self.vocabulary = vocabulary
+
+    @classmethod
+    def fromItems(cls, keys, counts, vocabulary=None):
+        """This method returns the CompactCounts of the count counts[i] for
+        each key keys[i]; keys should be all strings or all integers"""
+        if vocabulary is None:
+            vocabulary = VOCABULARY
+        keys = list(keys)
+        if all(isinstance(k, str) for k in keys):
+            kind = "str"
+            typecode = "I"
+            keys = [vocabulary.intern(k) for k in keys]
+        elif all(isinstance(k, int) for k in keys):
+            kind = "int"
+            typecode = "q"
+        else:
+            raise TypeError("the keys of CompactCounts should be all strings or all integers")
+        pairs = sorted(zip(keys, counts))
+        return cls(kind, array(typecode, [k for k, n in pairs]), array("q", [n for k, n in pairs]),
+                   vocabulary)
+
+    @classmethod
+    def fromDict(cls, d, vocabulary=None):
+        """This method returns the CompactCounts of the dictionary of counts d"""
+        return cls.fromItems(d.keys(), d.values(), vocabulary)
+
+    def __reduce__(self):
+        return (_restoreCompactCounts, (dict(self.items()),))
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def __len__(self):
+        return len(self.countArray)
+
+    def __iter__(self):
+        if self.kind == "str":
+            strings = self.vocabulary.strings
+            return (strings[i] for i in self.keyArray)
+        return iter(self.keyArray)
+
+    def position(self, k):
+        """This method returns the position of the key k in the arrays,
+        -1 if it is not there"""
+        if self.kind == "str":
+            if not isinstance(k, str):
+                return -1
+            k = self.vocabulary.ids.get(k)
+            if k is None:
+                return -1
+        elif not isinstance(k, int):
+            return -1
+        keys = self.keyArray
+        i = bisect_left(keys, k)
+        if i < len(keys) and keys[i] == k:
+            return i
+        return -1
+
+    def __getitem__(self, k):
+        i = self.position(k)
+        if i < 0:
+            raise KeyError(k)
+        return self.countArray[i]
+
+    def __contains__(self, k):
+        return self.position(k) >= 0
+
+    def get(self, k, default=None):
+        i = self.position(k)
+        if i < 0:
+            return default
+        return self.countArray[i]
+
+    def values(self):
+        return list(self.countArray)
+
+    def items(self):
+        return list(zip(self, self.countArray))
+
+def _restoreCompactCounts( d ):
+    """  _restoreCompactCounts unpickles CompactCounts, interning their
+         keys in the Vocabulary of the process they are unpickled in
+    """
+    return CompactCounts.fromDict(d)
+
+class CompactTextModel:
+
+    __slots__ = ("name", "cleaner", "ngrams", "enabled", "counts")
+
+    def __init__(self, name, counts, cleaner=None, ngrams=None):
+        """ the constructor for the CompactTextModel class
+            a CompactTextModel is a trained TextModel frozen to take as
+            little memory as it can, to keep many of them resident: each
+            dictionary is CompactCounts, whose string keys are interned in
+            the shared VOCABULARY, so words and stems, and every model,
+            hold their common keys once
+            counts maps each feature to its CompactCounts (or a dictionary
+            of counts, which is made compact); features are read as
+            attributes, model.words and so on, as for a TextModel
+
+            it can be compared, scored, ranked, printed and saved like a
+            TextModel, but not changed: see thaw
+        """
+        self.name = name
+        if cleaner is None:
+            cleaner = DEFAULT_CLEANER
+        self.cleaner = cleaner
+        self.ngrams = ngrams
+        self.counts = {}
+        for feature in counts:
+            c = counts[feature]
+            if not isinstance(c, CompactCounts):
+                c = CompactCounts.fromDict(c)
+            self.counts[feature] = c
+        self.enabled = tuple(self.counts)
+
+    @classmethod
+    def fromModel(cls, model):
+        """This method returns the CompactTextModel of the TextModel model"""
+        return cls(model.name, {f: CompactCounts.fromDict(getattr(model, f)) for f in model.featureNames()},
+                   model.cleaner, model.ngrams)
+
+    def __getattr__(self, name):
+        try:
+            counts = object.__getattribute__(self, "counts")
+        except AttributeError:
+            raise AttributeError(name)
+        if name in counts:
+            return counts[name]
+        raise AttributeError("CompactTextModel " + repr(self.name) + " has no dictionary " + repr(name))
+
+    @property
+    def views(self):
+        """no view of a CompactTextModel is cached, see view"""
+        return {}
+
+    source = None
+
+    def view(self, feature):
+        """This method returns a new FeatureView of the dictionary named
+        feature; views are not kept, as their normalized dictionaries would
+        take the memory the compact model saves"""
+        return FeatureView(getattr(self, feature))
+
+    def featureNames(self):
+        """This method returns the names of the dictionaries of the model"""
+        return self.enabled
+
+    def thaw(self):
+        """This method returns a TextModel with the same counts, which can
+        be changed"""
+        model = TextModel(self.name, self.cleaner, self.ngrams, self.enabled)
+        for feature in self.enabled:
+            setattr(model, feature, dict(self.counts[feature].items()))
+        return model
+
+    __repr__ = TextModel.__repr__
+    printAllDictionaries = TextModel.printAllDictionaries
+    features = TextModel.features
+    normalized = TextModel.normalized
+    saveModel = TextModel.saveModel
+    scoreTextWithTwoModels = TextModel.scoreTextWithTwoModels
+    compareTextWithTwoModels = TextModel.compareTextWithTwoModels
+
+def attributeAll( documents, models, processes=None, cleaner=None, batchSize=64,
+                  chunkSize=CHUNK_SIZE, timings=False, cache=None ):
+    """  attributeAll attributes many unknown documents to the given models,
+         an AuthorRegistry or a list of TextModels, and yields one
+         (name, Comparison) pair per document as soon as it is scored
+
+         each document is a filename or a (name, source) pair, where source
+         is a filename or a list of strings (file objects cannot be sent to
+         other processes); its name is the filename or the name given
+         the features of the documents are extracted by a pool of processes
+         (as many as there are CPUs if processes is None, none if it is 1)
+         and the documents are scored batchSize at a time against log
+         tables built once for all of them, so the results come back in the
+         order the documents finish, not the order they were given
+         cleaner defaults to the cleaner of the models; only the features
+         the models are scored on are extracted
+         with timings True it yields (name, Comparison, timings) instead,
+         timings being a dictionary with the seconds the extraction of the
+         document took, its share of the scoring of its batch, and the
+         size of that batch
+         cache is a FeatureCache for extractFeatures
+    """
+    if isinstance(models, AuthorRegistry):
+        registry = models
+    else:
+        registry = AuthorRegistry(models)
+    scorer = registry.getScorer()
+    names = [m.name for m in scorer.models]
+    if cleaner is None:
+        cleaner = scorer.models[0].cleaner
+    ngrams = scorer.models[0].ngrams
+    features = scorer.features
+
+    def tasks():
+        for document in documents:
+            if isinstance(document, tuple):
+                name, source = document
+            else:
+                name, source = document, document
+            yield name, source, cleaner, chunkSize, ngrams, features, cache if processes == 1 else None
+
+    def scored(batch):
+        start = time.perf_counter()
+        results = scorer.scoreMany([features for name, features, seconds in batch])
+        share = (time.perf_counter() - start) / max(len(batch), 1)
+        for i in range(len(batch)):
+            comparison = Comparison.fromScores(names, results[i])
+            if timings:
+                yield batch[i][0], comparison, {"extract": batch[i][2], "score": share,
+                                                "batch": len(batch)}
+            else:
+                yield batch[i][0], comparison
+
+    pool = None
+    if processes == 1:
+        extracted = map(_timedExtractTask, tasks())
+    else:
+        pool = _extractionPool(processes, cache)
+        extracted = pool.imap_unordered(_timedExtractTask, tasks())
+    try:
+        batch = []
+        for result in extracted:
+            batch.append(result)
+            if len(batch) >= batchSize:
+                yield from scored(batch)
+                batch = []
+        yield from scored(batch)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+class AttributionService:
+
+    def __init__(self, models, processes=None, maxBatch=64, maxDelay=0.005, k=5):
+        """ the constructor for the AttributionService class
+            an AttributionService answers attribution requests from asyncio
+            code: it keeps the trained models (an AuthorRegistry or a list
+            of TextModels) and their log tables resident, extracts the
+            features of each request in a pool of processes and scores the
+            requests that are waiting together, up to maxBatch of them and
+            waiting at most maxDelay seconds for a batch to fill, in one
+            vectorized pass; results hold the top k authors
+
+            use it as "async with AttributionService(models) as service:"
+            or call start() and stop() yourself
+        """
+        if isinstance(models, AuthorRegistry):
+            self.registry = models
+        else:
+            self.registry = AuthorRegistry(models)
+        self.processes = processes
+        self.maxBatch = maxBatch
+        self.maxDelay = maxDelay
+        self.k = k
+        self.executor = None
+        self.queue = None
+        self.batcher = None
+        self.batch = []   # the requests the batching task has taken from the queue
+        self.latencies = deque(maxlen=10000)   # total latency of the last requests
+        self.requests = 0
+
+    def __repr__(self):
+        """ this method creates the string version of AttributionService objects
+        """
+        return ("AttributionService(models=" + str(len(self.registry)) +
+                ", requests=" + str(self.requests) + ", running=" + str(self.batcher is not None) + ")")
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def start(self):
+        """This method starts the worker processes and the batching task"""
+        import asyncio
+        from concurrent.futures import ProcessPoolExecutor
+        if self.batcher is not None:
+            return
+        self.scorer = self.registry.getScorer()
+        self.names = [m.name for m in self.scorer.models]
+        self.cleaner = self.scorer.models[0].cleaner
+        self.ngrams = self.scorer.models[0].ngrams
+        self.executor = ProcessPoolExecutor(self.processes)
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.ensure_future(self.runBatches())
+
+    async def stop(self):
+        """This method stops the batching task and the worker processes; the
+        requests still waiting to be scored raise a RuntimeError, and those
+        still being extracted are cancelled"""
+        import asyncio
+        if self.batcher is None:
+            return
+        batcher = self.batcher
+        self.batcher = None
+        batcher.cancel()
+        try:
+            await batcher
+        except asyncio.CancelledError:
+            pass
+        waiting = self.batch
+        self.batch = []
+        while not self.queue.empty():
+            waiting.append(self.queue.get_nowait())
+        for features, result, extracted in waiting:
+            if not result.done():
+                result.set_exception(RuntimeError("the AttributionService was stopped"))
+        executor = self.executor
+        self.executor = None
+        # shutting down waits for the workers, which would block the event loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, lambda: executor.shutdown(wait=True, cancel_futures=True))
+
+    async def attribute(self, text, name=None):
+        """This method attributes the text of one request and returns a
+        dictionary with the Comparison as plain data, the ranking of the
+        top k authors and the latency of each stage in seconds"""
+        import asyncio
+        if self.batcher is None:
+            raise RuntimeError("the AttributionService is not started")
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        features = await loop.run_in_executor(self.executor, extractFeatures, [text], self.cleaner,
+                                              CHUNK_SIZE, self.ngrams, self.scorer.features)
+        extracted = loop.time()
+        if self.batcher is None:   # stopped while the features were extracted
+            raise RuntimeError("the AttributionService was stopped")
+        result = loop.create_future()
+        await self.queue.put((features, result, extracted))
+        comparison, queued, scored = await result
+        finished = loop.time()
+        answer = comparison.asDict()
+        answer["name"] = name
+        answer["ranking"] = comparison.rank(self.k)
+        answer["latency"] = {"extract": extracted - started, "queue": queued - extracted,
+                             "score": scored - queued, "total": finished - started}
+        self.requests += 1
+        self.latencies.append(finished - started)
+        return answer
+
+    async def runBatches(self):
+        """This method is the batching task: it takes the waiting requests,
+        up to maxBatch of them, scores them together in a thread so the
+        event loop keeps running, and hands each request its Comparison"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = self.batch = [await self.queue.get()]
+            deadline = loop.time() + self.maxDelay
+            while len(batch) < self.maxBatch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            queued = loop.time()
+            try:
+                scores = await loop.run_in_executor(None, self.scorer.scoreMany,
+                                                    [features for features, result, extracted in batch])
+            except Exception as e:
+                for features, result, extracted in batch:
+                    if not result.done():
+                        result.set_exception(e)
+                continue
+            scored = loop.time()
+            for i in range(len(batch)):
+                result = batch[i][1]
+                if not result.done():
+                    result.set_result((Comparison.fromScores(self.names, scores[i]), queued, scored))
+            self.batch = []
+
+    def latencyStats(self):
+        """This method returns the count, mean, median, 99th percentile and
+        largest of the total latencies of the last 10000 requests, in seconds"""
+        values = sorted(self.latencies)
+        if not values:
+            return {"count": 0, "mean": None, "p50": None, "p99": None, "max": None}
+        return {"count": len(values), "mean": sum(values) / len(values),
+                "p50": values[(len(values) - 1) // 2],
+                "p99": values[min(len(values) - 1, int(len(values) * 0.99))],
+                "max": values[-1]}
+
+def _profiledExtractTask( task ):
+    """  _profiledExtractTask runs _timedExtractTask in a worker process of
+         crossValidate, profiling its stages, and also returns their
+         statistics
+    """
+    with StageProfiler() as profiler:
+        name, features, seconds = _timedExtractTask(task)
+    return name, features, seconds, profiler.stats
+
+def _foldTask( task ):
+    """  _foldTask tests one fold of crossValidate, in a worker process:
+         the model of each author is its total counts less the counts of
+         its documents in the fold, and the documents of the fold are
+         attributed to those models; returns the fold, the list of
+         (document, author, predicted author) and the stage statistics
+    """
+    fold, totals, held, documents, cleaner, ngrams, features, method, useNumpy = task
+    with StageProfiler() as profiler:
+        models = []
+        for author in totals:
+            model = TextModel(author, cleaner, ngrams, features)
+            for feature in model.featureNames():
+                setattr(model, feature, totals[author].get(feature, {}))
+            if author in held:
+                model.removeFeatures(held[author])
+            models.append(model)
+        scorer = ModelScorer(models, features, useNumpy, method)
+        names = [m.name for m in models]
+        results = []
+        if documents:
+            scores = scorer.scoreMany([d[2] for d in documents])
+            for i in range(len(documents)):
+                comparison = Comparison.fromScores(names, scores[i])
+                results.append((documents[i][0], documents[i][1], names[comparison.winner]))
+    return fold, results, profiler.stats
+
+def crossValidate( corpus, folds=5, processes=None, cleaner=None, ngrams=None, features=None,
+                   method="likelihood", useNumpy=True, seed=0, chunkSize=CHUNK_SIZE, cache=None ):
+    """  crossValidate measures how well and how fast the authors of corpus,
+         a dictionary mapping each author to a list of filenames, are told
+         apart, by k-fold cross-validation: the documents of each author
+         are shuffled (by seed) and dealt into folds folds, and each fold
+         in turn is attributed to models trained on the other folds
+
+         every document is read and extracted only once, in a pool of
+         processes (see trainModels for processes); each author's counts
+         are merged once, per fold and in total, and the model a fold is
+         tested against is the total less the fold, so no model is trained
+         again from text; the folds are tested in parallel too
+
+         cleaner, ngrams, features, method and useNumpy are those of the
+         TextModels and ModelScorer, cache a FeatureCache for the
+         extraction; returns a dictionary with the
+         accuracy, overall and per fold and per author, the documents per
+         second of the whole evaluation, of extraction and of testing,
+         and the statistics of every stage (see StageProfiler.metrics)
+    """
+    import random
+    if folds < 2:
+        raise ValueError("cross-validation needs at least 2 folds, not " + str(folds))
+    if features is None:
+        features = TextModel(None, cleaner, ngrams).featureNames()
+    features = tuple(features)
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    foldOf = {}   # filename -> fold
+    authorOf = {}
+    for author in corpus:
+        files = list(corpus[author])
+        rng.shuffle(files)
+        for i in range(len(files)):
+            foldOf[files[i]] = i % folds
+            authorOf[files[i]] = author
+    inProcess = processes == 1 or len(foldOf) <= 1
+    tasks = [(filename, filename, cleaner, chunkSize, ngrams, features, cache if inProcess else None)
+             for filename in foldOf]
+
+    profiler = StageProfiler()
+    extracted = {}   # filename -> features
+    if inProcess:
+        results = map(_profiledExtractTask, tasks)
+        pool = None
+    else:
+        pool = _extractionPool(processes, cache)
+        results = pool.imap_unordered(_profiledExtractTask, tasks)
+    try:
+        totals = {author: {} for author in corpus}
+        parts = [{} for i in range(folds)]   # fold -> author -> merged features
+        extractSeconds = 0.0
+        for filename, documentFeatures, seconds, stats in results:
+            extracted[filename] = documentFeatures
+            extractSeconds += seconds
+            profiler.merge(stats)
+            author = authorOf[filename]
+            mergeFeatures(totals[author], documentFeatures)
+            mergeFeatures(parts[foldOf[filename]].setdefault(author, {}), documentFeatures)
+        extracting = time.perf_counter() - started
+
+        foldTasks = []
+        for fold in range(folds):
+            documents = [(f, authorOf[f], extracted[f]) for f in extracted if foldOf[f] == fold]
+            foldTasks.append((fold, totals, parts[fold], documents, cleaner, ngrams, features,
+                              method, useNumpy))
+        if pool is None:
+            tested = map(_foldTask, foldTasks)
+        else:
+            tested = pool.imap_unordered(_foldTask, foldTasks)
+        byFold = {}
+        for fold, foldResults, stats in tested:
+            byFold[fold] = foldResults
+            profiler.merge(stats)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    seconds = time.perf_counter() - started
+
+    correct = 0
+    documents = 0
+    perFold = []
+    perAuthor = {author: {"documents": 0, "correct": 0} for author in corpus}
+    for fold in range(folds):
+        right = sum(1 for f, author, predicted in byFold[fold] if author == predicted)
+        perFold.append(right / len(byFold[fold]) if byFold[fold] else None)
+        for f, author, predicted in byFold[fold]:
+            perAuthor[author]["documents"] += 1
+            perAuthor[author]["correct"] += author == predicted
+        correct += right
+        documents += len(byFold[fold])
+    for author in perAuthor:
+        n = perAuthor[author]["documents"]
+        perAuthor[author]["accuracy"] = perAuthor[author]["correct"] / n if n else None
+    testing = seconds - extracting
+    return {"folds": folds, "documents": documents, "correct": correct,
+            "accuracy": correct / documents if documents else None,
+            "foldAccuracy": perFold, "authors": perAuthor,
+            "seconds": seconds, "extractSeconds": extracting, "testSeconds": testing,
+            "docs/s": documents / seconds if seconds > 0 else None,
+            "extractDocs/s": documents / extracting if extracting > 0 else None,
+            "testDocs/s": documents / testing if testing > 0 else None,
+            "workerExtractSeconds": extractSeconds,
+            "stages": profiler.metrics()}
+
+def corpusFromDirectory( directory, pattern="*.txt" ):
+    """  corpusFromDirectory returns the corpus of directory, which holds a
+         subdirectory of texts for each author, as trainModels takes it:
+         a dictionary mapping each subdirectory name to the sorted list of
+         its files matching pattern; authors without files are left out
+    """
+    import glob
+    corpus = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, pattern)))
+            if files:
+                corpus[name] = files
+    return corpus
+
+def expandDocuments( paths, pattern="*.txt" ):
+    """  expandDocuments returns the sorted list of files named by paths:
+         each path is a directory, whose files matching pattern are taken,
+         or a glob pattern, or a file
+    """
+    import glob
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, pattern))))
+        else:
+            files.extend(sorted(glob.glob(path)) or [path])
+    return files
+
+def loadModels( directory, compact=True ):
+    """  loadModels returns the list of the models saved in directory,
+         every file ending in .tm, as CompactTextModels unless compact
+         is False
+    """
+    import glob
+    return [loadTextModel(filename, compact=compact)
+            for filename in sorted(glob.glob(os.path.join(directory, "*.tm")))]
+
+def main( argv=None ):
+    """  main is the command line tool, run as python Text_Model.py:
+
+             train AUTHORS -o MODELS
+                 trains one model per subdirectory of AUTHORS and saves
+                 each to MODELS/<author>.tm
+             attribute (--models MODELS | --authors AUTHORS) PATH...
+                 attributes every text named by PATH (directories, globs
+                 or files) and writes one JSON line per text to stdout, as
+                 soon as it is scored; with --models, --features picks the
+                 features of the saved models to score on
+             evaluate AUTHORS
+                 cross-validates the models of AUTHORS and writes the
+                 accuracy and throughput as JSON, see crossValidate
+
+         both take --processes, the size of the worker pool; numpy, which
+         the scoring uses when it is installed, is only imported once the
+         models are loaded
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="Text_Model.py",
+                                     description="Train author models and attribute unknown texts.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def common(p):
+        p.add_argument("--processes", type=int, default=None,
+                       help="worker processes, as many as CPUs by default, 1 for none")
+        p.add_argument("--pattern", default="*.txt", help="the files to read from a directory")
+        p.add_argument("--cache", help="directory to keep extracted features in, see FeatureCache")
+        p.add_argument("--cache-size", type=int, default=1024, help="largest size of the cache in MB")
+
+    def building(p):
+        p.add_argument("--features", default=None,
+                       help="comma separated features to build, out of " + ", ".join(FEATURE_EXTRACTORS) +
+                       "; with --models, the features of the models to score on")
+        p.add_argument("--ngrams", action="store_true", help="count hashed character and word n-grams")
+        p.add_argument("--buckets", type=int, default=None, help="n-gram buckets, 2**18 by default")
+
+    train = commands.add_parser("train", help="train and save one model per author directory")
+    train.add_argument("authors", help="directory with one subdirectory of texts per author")
+    train.add_argument("-o", "--output", required=True, help="directory to save the models in")
+    common(train)
+    building(train)
+
+    attribute = commands.add_parser("attribute", help="attribute unknown texts, writing JSON lines")
+    models = attribute.add_mutually_exclusive_group(required=True)
+    models.add_argument("--models", help="directory of models saved by train")
+    models.add_argument("--authors", help="directory of author texts to train the models from")
+    attribute.add_argument("paths", nargs="+", help="texts to attribute: directories, globs or files")
+    attribute.add_argument("--top", type=int, default=5, help="authors to rank in each result")
+    attribute.add_argument("--method", default="likelihood", choices=sorted(SCORERS),
+                           help="how each feature is scored")
+    attribute.add_argument("--batch-size", type=int, default=64, help="texts scored together")
+    common(attribute)
+    building(attribute)
+
+    evaluate = commands.add_parser("evaluate", help="cross-validate the author models")
+    evaluate.add_argument("authors", help="directory with one subdirectory of texts per author")
+    evaluate.add_argument("--folds", type=int, default=5, help="number of folds")
+    evaluate.add_argument("--seed", type=int, default=0, help="seed of the shuffle into folds")
+    evaluate.add_argument("--method", default="likelihood", choices=sorted(SCORERS),
+                          help="how each feature is scored")
+    common(evaluate)
+    building(evaluate)
+    args = parser.parse_args(argv)
+
+    features = None
+    if args.features:
+        features = tuple(f.strip() for f in args.features.split(",") if f.strip())
+    ngrams = None
+    if args.command == "attribute" and args.models and (args.ngrams or args.buckets is not None):
+        parser.error("--ngrams and --buckets only apply to models trained here, not to --models")
+    if args.ngrams:
+        ngrams = NGrams(buckets=args.buckets if args.buckets is not None else 1 << 18)
+    cache = None
+    if args.cache:
+        cache = FeatureCache(args.cache, args.cache_size * 1000 * 1000)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    def train(directory):
+        corpus = corpusFromDirectory(directory, args.pattern)
+        if not corpus:
+            parser.error("no author directories with " + args.pattern + " files in " + directory)
+        start = time.perf_counter()
+        trained = trainModels(corpus, args.processes, ngrams=ngrams, features=features, cache=cache)
+        log("trained " + str(len(trained)) + " models from " +
+            str(sum(len(files) for files in corpus.values())) + " files in " +
+            "%.2f" % (time.perf_counter() - start) + "s")
+        return [trained[name] for name in corpus]
+
+    try:
+        if args.command == "evaluate":
+            corpus = corpusFromDirectory(args.authors, args.pattern)
+            if not corpus:
+                parser.error("no author directories with " + args.pattern + " files in " + args.authors)
+            report = crossValidate(corpus, args.folds, args.processes, ngrams=ngrams,
+                                   features=features, method=args.method, seed=args.seed,
+                                   cache=cache)
+            print(json.dumps(report, indent=1))
+            return 0
+
+        if args.command == "train":
+            trained = train(args.authors)
+            os.makedirs(args.output, exist_ok=True)
+            for model in trained:
+                model.saveModel(os.path.join(args.output, model.name + ".tm"))
+            log("saved them in " + args.output)
+            return 0
+
+        if args.models:
+            found = loadModels(args.models)
+            if not found:
+                parser.error("no .tm models in " + args.models)
+            if features:
+                missing = [f for f in features if f not in found[0].featureNames()]
+                if missing:
+                    parser.error("the models in " + args.models + " have no " + ", ".join(missing))
+        else:
+            found = train(args.authors)
+        documents = expandDocuments(args.paths, args.pattern)
+        start = time.perf_counter()
+        registry = AuthorRegistry(found, features=features, method=args.method)
+        registry.getScorer()
+        log("built the tables of " + str(len(found)) + " models in " +
+            "%.2f" % (time.perf_counter() - start) + "s")
+        start = time.perf_counter()
+        n = 0
+        for name, comparison, timings in attributeAll(documents, registry, args.processes,
+                                                      batchSize=args.batch_size, timings=True,
+                                                      cache=cache):
+            ranking = []
+            for author, votes, total in comparison.rank(args.top):
+                i = comparison.names.index(author)
+                ranking.append({"author": author, "votes": votes, "total": total,
+                                "scores": {f: comparison.scores[f][i] for f in comparison.scores}})
+            print(json.dumps({"document": name, "author": comparison.names[comparison.winner],
+                              "ranking": ranking, "timings": timings}), flush=True)
+            n += 1
+        seconds = time.perf_counter() - start
+        log("attributed " + str(n) + " texts in " + "%.2f" % seconds + "s" +
+            ("" if not seconds else " (%.1f texts/s)" % (n / seconds)))
+        return 0
+    except BrokenPipeError:
+        # whatever read stdout has stopped, e.g. head: there is no one left to tell
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except (OSError, ValueError) as e:
+        log("error: " + str(e))
+        return 1
 
+if __name__ == "__main__":
+    sys.exit(main())
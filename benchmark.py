@@ -0,0 +1,297 @@
+"""Benchmarks for the hot paths of Text_Model
+
+Runs every stage of building and comparing TextModels (cleaning,
+tokenizing, each make* method, stemming, createAllDictionaries, streaming
+and comparison) over generated corpora of several sizes and reports, for
+each stage, its throughput in MB/s and tokens/s and its peak memory.
+
+Two kinds of corpus are generated, deterministically, so that every run
+measures the same text:
+
+    synthetic   words drawn uniformly from a small vocabulary, one space
+                apart, with a sentence ending every dozen words or so
+    prose       public-domain-style prose: a Zipf-distributed English
+                vocabulary, sentences and paragraphs of varying length,
+                commas, dialogue in quotes, dashes and parentheses
+
+Between consecutive sizes the scaling exponent of each stage is printed
+(1.0 is linear); an exponent well above 1 is how the old quadratic loops
+showed up, and is flagged.
+
+Results can be saved as a baseline and later runs compared against it:
+
+    python benchmark.py --sizes 10KB,100KB,1MB --save-baseline base.json
+    python benchmark.py --sizes 10KB,100KB,1MB --baseline base.json
+
+A stage slower than the baseline by more than the tolerance, or scaling
+worse than --max-exponent, makes the run exit with status 1.
+"""
+
+import sys
+import gc
+import json
+import math
+import time
+import random
+import argparse
+import tracemalloc
+
+import Text_Model
+
+SIZES = {"10KB": 10 * 1000, "100KB": 100 * 1000, "1MB": 1000 * 1000,
+         "10MB": 10 * 1000 * 1000, "100MB": 100 * 1000 * 1000}
+
+PROSE_WORDS = """the of and to a in that he was it his is with as i had for at by
+on not be her which but from have you all they this my so were one she him
+me we an there would their been if when are no what or said more who could
+into some upon them then up out than only its little very any time now
+great our made well such should like these down may did other man about over
+your after before must two much upon never good shall every own long those
+old how being same thought first again know come through think without
+upon life might most eyes still found whole heart house hand nothing place
+day away while yet though once herself himself mind world last each even
+under between many night always face never words left give across father
+mother young something another room sister brother friend letter morning
+evening answered replied cried looked turned seemed appeared returned began
+felt knew saw heard told asked wished hoped believed happiness generally
+particularly immediately certainly perfectly exceedingly conversation
+acquaintance satisfaction affectionate consideration relations meetings
+feelings agreeable disagreeable understanding neighbourhood circumstances""".split()
+
+def makeCorpus( kind, size, seed=1 ):
+    """  makeCorpus returns about size characters of generated text of kind
+         "synthetic" or "prose", the same text for the same arguments
+    """
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    if kind == "synthetic":
+        vocabulary = PROSE_WORDS[:64]
+        while length < size:
+            sentence = " ".join(rng.choice(vocabulary) for i in range(rng.randint(6, 18))) + ". "
+            parts.append(sentence)
+            length += len(sentence)
+        return "".join(parts)[:size]
+    if kind != "prose":
+        raise ValueError("the corpus kind should be 'synthetic' or 'prose', not " + repr(kind))
+    weights = [1 / (rank + 1) for rank in range(len(PROSE_WORDS))]
+    while length < size:
+        paragraph = []
+        for s in range(rng.randint(1, 6)):
+            words = rng.choices(PROSE_WORDS, weights, k=rng.randint(3, 30))
+            words[0] = words[0].capitalize()
+            for i in range(1, len(words) - 1):
+                r = rng.random()
+                if r < 0.08:
+                    words[i] += ","
+                elif r < 0.09:
+                    words[i] += ";"
+                elif r < 0.10:
+                    words[i] = "(" + words[i] + ")"
+                elif r < 0.11:
+                    words[i] += " --"
+            sentence = " ".join(words) + rng.choice("....!?")
+            if rng.random() < 0.2:
+                sentence = '"' + sentence + '" ' + rng.choice(["he said.", "said she.", "cried Elizabeth."])
+            paragraph.append(sentence)
+        paragraph = " ".join(paragraph) + "\n\n"
+        parts.append(paragraph)
+        length += len(paragraph)
+    return "".join(parts)[:size]
+
+def stages( text ):
+    """  stages returns the list of (name, function) pairs of the stages to
+         time on text; every function takes no arguments and does the stage
+         over the whole text once
+    """
+    model = Text_Model.TextModel("benchmark")
+    cleaner = model.cleaner
+    words = cleaner.clean(text).split()
+    vocabulary = list(dict.fromkeys(words))
+    half = len(text) // 2
+    model1 = Text_Model.TextModel("first half")
+    model1.createAllDictionaries(text[:half])
+    model2 = Text_Model.TextModel("second half")
+    model2.createAllDictionaries(text[half:])
+    unknown = Text_Model.TextModel("unknown")
+    unknown.createAllDictionaries(text)
+    ngramModel = Text_Model.TextModel("n-grams", ngrams=Text_Model.NGrams())
+
+    def consume(tokens):
+        for token in tokens:
+            pass
+
+    def createStems():
+        for w in words:
+            Text_Model.create_stem(w)
+
+    def stemVocabulary():
+        stemmer = Text_Model.FastPorterStemmer()
+        for w in vocabulary:
+            stemmer.stem(w, 0, len(w) - 1)
+
+    def compareWords():
+        nd1 = model1.normalizeDictionary(model1.words)
+        nd2 = model1.normalizeDictionary(model2.words)
+        unknown.compareDictionaries(unknown.words, nd1, nd2)
+
+    def chunks():
+        model.createAllDictionariesFromFile([text[i:i + 65536] for i in range(0, len(text), 65536)])
+
+    return [("cleanString", lambda: model.cleanString(text)),
+            ("tokenize", lambda: consume(cleaner.tokenize(text))),
+            ("makeWords", lambda: model.makeWords(text)),
+            ("makeSentenceLengths", lambda: model.makeSentenceLengths(text)),
+            ("makeWordLengths", lambda: model.makeWordLengths(text)),
+            ("makePunctuation", lambda: model.makePunctuation(text)),
+            ("makeStems", lambda: model.makeStems(text)),
+            ("create_stem", createStems),
+            ("stemVocabulary", stemVocabulary),
+            ("createAllDictionaries", lambda: model.createAllDictionaries(text)),
+            ("createAllWithNGrams", lambda: ngramModel.createAllDictionaries(text)),
+            ("streamInChunks", chunks),
+            ("compareDictionaries", compareWords),
+            ("scoreTextWithTwoModels", lambda: unknown.scoreTextWithTwoModels(model1, model2))]
+
+def timeStage( function, repeat ):
+    """  timeStage returns the best wall time of repeat runs of function;
+         the stem cache is emptied before each run so that no stage is
+         helped by the ones before it
+    """
+    best = None
+    for i in range(repeat):
+        Text_Model.STEM_CACHE.clear()
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def peakMemory( function ):
+    """  peakMemory returns the peak bytes allocated while running function
+    """
+    Text_Model.STEM_CACHE.clear()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run( kinds, sizes, repeat=3, memory=True, only=None, out=sys.stdout ):
+    """  run benchmarks every stage over every corpus and returns the results
+         as a dictionary mapping "kind/size/stage" to a dictionary with the
+         seconds, MB/s, tokens/s and peak memory of the stage
+    """
+    results = {}
+    print("%-9s %-6s %-24s %10s %10s %12s %10s" %
+          ("corpus", "size", "stage", "seconds", "MB/s", "tokens/s", "peak MB"), file=out)
+    for kind in kinds:
+        for size in sizes:
+            text = makeCorpus(kind, SIZES[size])
+            megabytes = len(text.encode("utf-8")) / 1e6
+            tokens = len(text.split())
+            for name, function in stages(text):
+                if only and name not in only:
+                    continue
+                seconds = timeStage(function, repeat)
+                peak = None
+                if memory:
+                    peak = peakMemory(function)
+                results[kind + "/" + size + "/" + name] = {
+                    "seconds": seconds, "MB/s": megabytes / seconds,
+                    "tokens/s": tokens / seconds, "peak": peak}
+                print("%-9s %-6s %-24s %10.4f %10.2f %12.0f %10s" %
+                      (kind, size, name, seconds, megabytes / seconds, tokens / seconds,
+                       "-" if peak is None else "%.1f" % (peak / 1e6)), file=out)
+    return results
+
+def scaling( results, kinds, sizes, maxExponent, out=sys.stdout ):
+    """  scaling prints the exponent of the growth of each stage's time
+         between consecutive sizes and returns the list of those above
+         maxExponent
+    """
+    bad = []
+    for kind in kinds:
+        for i in range(1, len(sizes)):
+            small, large = sizes[i - 1], sizes[i]
+            for key in results:
+                k, size, stage = key.split("/")
+                if k != kind or size != large:
+                    continue
+                before = results.get(kind + "/" + small + "/" + stage)
+                if before is None or before["seconds"] <= 0:
+                    continue
+                exponent = (math.log(results[key]["seconds"] / before["seconds"]) /
+                            math.log(SIZES[large] / SIZES[small]))
+                flag = ""
+                if exponent > maxExponent and results[key]["seconds"] > 0.01:
+                    flag = "   <-- superlinear"
+                    bad.append((kind, small, large, stage, exponent))
+                print("scaling %-9s %6s -> %-6s %-24s %5.2f%s" %
+                      (kind, small, large, stage, exponent, flag), file=out)
+    return bad
+
+def compare( results, baseline, tolerance, out=sys.stdout ):
+    """  compare prints the throughput of each stage against the baseline
+         results and returns the list of stages slower by more than tolerance;
+         like superlinear scaling, this is only flagged for stages that take
+         more than 10ms, as shorter timings are mostly noise
+    """
+    bad = []
+    for key in results:
+        if key not in baseline:
+            continue
+        ratio = results[key]["MB/s"] / baseline[key]["MB/s"]
+        flag = ""
+        if ratio < 1 - tolerance and results[key]["seconds"] > 0.01:
+            flag = "   <-- regression"
+            bad.append((key, ratio))
+        print("baseline %-45s %6.2fx%s" % (key, ratio, flag), file=out)
+    return bad
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser(description="Benchmark the Text_Model hot paths.")
+    parser.add_argument("--sizes", default="10KB,100KB,1MB",
+                        help="comma separated corpus sizes out of " + ",".join(SIZES))
+    parser.add_argument("--corpora", default="synthetic,prose",
+                        help="comma separated corpus kinds: synthetic, prose")
+    parser.add_argument("--stages", default="", help="comma separated stages to run, all by default")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best is kept")
+    parser.add_argument("--no-memory", action="store_true", help="do not measure peak memory")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against the results saved in this file")
+    parser.add_argument("--save-baseline", help="save the results as a baseline in this file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed fraction of throughput lost against the baseline")
+    parser.add_argument("--max-exponent", type=float, default=1.3,
+                        help="largest acceptable scaling exponent between sizes")
+    args = parser.parse_args(argv)
+
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    for size in sizes:
+        if size not in SIZES:
+            parser.error("unknown size " + size + ", use " + ",".join(SIZES))
+    sizes.sort(key=SIZES.get)
+    kinds = [k.strip() for k in args.corpora.split(",") if k.strip()]
+    only = set(s.strip() for s in args.stages.split(",") if s.strip())
+
+    results = run(kinds, sizes, args.repeat, not args.no_memory, only)
+    failures = scaling(results, kinds, sizes, args.max_exponent)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures += compare(results, json.load(f), args.tolerance)
+    for filename in (args.json, args.save_baseline):
+        if filename:
+            with open(filename, "w") as f:
+                json.dump(results, f, indent=1, sort_keys=True)
+    if failures:
+        print(str(len(failures)) + " stage(s) regressed or scaled superlinearly")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
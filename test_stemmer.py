@@ -0,0 +1,71 @@
+"""Conformance test of FastPorterStemmer against PorterStemmer
+
+Stems a fixed list of English words, every Porter suffix on a set of
+stems, and random letter strings, with both stemmers, and fails on the
+first words they stem differently.
+
+    python -m pytest test_stemmer.py
+"""
+
+import random
+
+import Text_Model
+
+WORDS = """caresses ponies ties caress cats feed agreed plastered bled motoring
+sing conflated troubled sized hopping tanned falling hissing fizzed failing
+filing happy sky relational conditional rational valenci hesitanci digitizer
+conformabli radicalli differentli vileli analogousli vietnamization
+predication operator feudalism decisiveness hopefulness callousness
+formaliti sensitiviti sensibiliti triplicate formative formalize
+electriciti electrical hopeful goodness revival allowance inference airliner
+gyroscopic adjustable defensible irritant replacement adjustment dependent
+adoption homologou communism activate angulariti homologous effective
+bowdlerize probate rate cease controll roll generous generously generalization
+happiness happily agreement disagreeable understanding neighbourhood
+circumstances acquaintance satisfaction affectionate consideration relations
+meetings feelings particularly immediately certainly perfectly exceedingly
+conversation answered replied cried looked turned seemed appeared returned
+a i is as us yes eyes y ay oy by bye dying lying tying eed bled ed ing""".split()
+
+SUFFIXES = """s es ies sses ss ed eed ing ly y ational tional enci anci izer bli
+alli entli eli ousli ization ation ator alism iveness fulness ousness aliti
+iviti biliti logi icate ative alize iciti ical ful ness al ance ence er ic
+able ible ant ement ment ent ion ou ism ate iti ous ive ize e ll""".split()
+
+STEMS = """rel cond hop tan fall fil sens form electr depend adopt activ
+bowdl prob contr gener happ agre troubl siz conflat motor plaster""".split()
+
+def words( count=100000, seed=4 ):
+    """  words returns the list of words both stemmers are run on: the fixed
+         words, every stem with every suffix and every pair of suffixes,
+         and count random words weighted towards suffix-heavy endings
+    """
+    result = list(WORDS)
+    for stem in STEMS:
+        for suffix in SUFFIXES:
+            result.append(stem + suffix)
+            for second in SUFFIXES:
+                result.append(stem + suffix + second)
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz" + "aeiouy" * 3
+    for i in range(count):
+        word = "".join(rng.choice(letters) for j in range(rng.randint(1, 9)))
+        if rng.random() < 0.7:
+            word += rng.choice(SUFFIXES)
+        result.append(word)
+    return result
+
+def test_fast_stemmer_matches_reference():
+    mismatches = Text_Model.checkStemmer(words())
+    assert mismatches == [], mismatches[:20]
+
+def test_stem_cache_matches_reference():
+    cache = Text_Model.StemCache(maxsize=1000)
+    reference = Text_Model.PorterStemmer()
+    for w in words(5000):
+        assert cache.stem(w) == reference.stem(w, 0, len(w) - 1), w
+
+if __name__ == "__main__":
+    test_fast_stemmer_matches_reference()
+    test_stem_cache_matches_reference()
+    print("ok")
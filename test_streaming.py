@@ -0,0 +1,95 @@
+"""Tests that streamed, whole-text and saved models agree
+
+A TextModel built from a text in chunks of any size, with
+createAllDictionariesFromFile, should hold exactly the counts of one
+built from the whole text with createAllDictionaries: words cut by a
+chunk, sentences going on across chunks, word n-grams starting in one
+chunk and ending in the next, and the token after a period that decides
+whether it ends a sentence all carry over. A model saved and loaded back,
+plainly, lazily or compact, should hold the same counts again.
+
+    python -m pytest test_streaming.py
+"""
+
+import os
+import random
+import tempfile
+
+import Text_Model
+
+SENTENCES = ["It was J. Smith who came, and Mr. Brown.", "So did I.", "He said no.",
+             "The U.S. economy grew -- e.g. in Feb. and Mar.", "Wait... what?!",
+             "\"Stop!\" she cried. (Then nothing.)", "Pi is 3.14, not 3.", "Plan B. Then C.",
+             "Naïve cafés sold crème brûlée.", "Stop ! ! Go ?",
+             "a b c a b c a b c.", "Ends without an ending"]
+
+def text( count=400, seed=5 ):
+    """  text returns count sentences drawn from SENTENCES and random
+         words, with varied whitespace between them
+    """
+    rng = random.Random(seed)
+    words = "the of and to a in that he was it his is with as i had".split()
+    parts = []
+    for i in range(count):
+        if rng.random() < 0.5:
+            parts.append(rng.choice(SENTENCES))
+        else:
+            sentence = " ".join(rng.choice(words) for j in range(rng.randint(1, 15)))
+            parts.append(sentence.capitalize() + rng.choice(".!?"))
+        parts.append(rng.choice([" ", "  ", "\n", "\n\n", "\t"]))
+    return "".join(parts)
+
+def model( name ):
+    """  model returns an empty TextModel counting every built-in feature,
+         n-grams included
+    """
+    return Text_Model.TextModel(name, ngrams=Text_Model.NGrams(buckets=4096),
+                                features=Text_Model.FEATURES + Text_Model.NGRAM_FEATURES)
+
+def test_chunks_match_whole_text():
+    s = text()
+    whole = model("whole")
+    whole.createAllDictionaries(s)
+    expected = whole.features()
+    assert expected["sentencelengths"] and expected["wordgrams"] and expected["chargrams"]
+    rng = random.Random(6)
+    for size in [1, 2, 3, 5, 8, 13, 64, 1000, len(s)] + [rng.randint(1, 200) for i in range(10)]:
+        streamed = model("streamed")
+        streamed.createAllDictionariesFromFile([s[i:i + size] for i in range(0, len(s), size)])
+        assert streamed.features() == expected, size
+
+def test_file_matches_whole_text():
+    s = text(seed=7)
+    whole = model("whole")
+    whole.createAllDictionaries(s)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "text.txt")
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(s)
+        for chunkSize in (7, 100, 4096):
+            streamed = model("streamed")
+            streamed.createAllDictionariesFromFile(filename, chunkSize)
+            assert streamed.features() == whole.features(), chunkSize
+
+def test_saved_models_load_back():
+    original = model("saved")
+    original.createAllDictionaries(text(seed=8))
+    expected = original.features()
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "saved.tm")
+        original.saveModel(filename)
+        for options in ({}, {"lazy": True}, {"compact": True}):
+            loaded = Text_Model.loadTextModel(filename, **options)
+            assert loaded.name == "saved", options
+            assert loaded.featureNames() == original.featureNames(), options
+            assert loaded.ngrams == original.ngrams, options
+            assert repr(loaded.cleaner) == repr(original.cleaner), options
+            counts = {feature: dict(getattr(loaded, feature).items()) for feature in loaded.featureNames()}
+            assert counts == expected, options
+            del loaded
+
+if __name__ == "__main__":
+    test_chunks_match_whole_text()
+    test_file_matches_whole_text()
+    test_saved_models_load_back()
+    print("ok")